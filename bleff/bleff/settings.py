@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+import django
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'game.middleware.PerformanceMiddleware',
+    'game.middleware.NPlusOneMiddleware',
+    'game.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,13 +57,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'game.middleware.CaptureMiddleware',
 ]
 
 ROOT_URLCONF = 'bleff.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'game.template_backends.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,6 +88,58 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests instead of reconnecting every time.
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Seconds a statement waits for another connection's lock before failing with "database is locked".
+            # This is SQLite's busy timeout, don't set it again in SQLITE_PRAGMAS.
+            'timeout': int(os.environ.get('BLEFF_SQLITE_TIMEOUT', 20)),
+        },
+    }
+}
+
+# Transactions take the write lock when they start, so a read-then-write block waits for the timeout
+# instead of failing with "database is locked" when another writer got there first (Django 5.1+).
+if django.VERSION >= (5, 1):
+    DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+# Optional read replica (e.g. a copy of db.sqlite3) used by views decorated with 'replica_reads'.
+if os.environ.get('BLEFF_REPLICA_DB'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['BLEFF_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Optional game shards: BLEFF_GAME_SHARDS=N adds N SQLite files and spreads games over them by id.
+# Only for the 'benchmark_shards' command: the app doesn't pick a shard per request, so game queries made
+# outside game.routers.use_shard raise ImproperlyConfigured.
+GAME_SHARDS = []
+
+for shard in range(int(os.environ.get('BLEFF_GAME_SHARDS', 0))):
+    GAME_SHARDS.append(f'shard_{shard}')
+    DATABASES[f'shard_{shard}'] = {**DATABASES['default'], 'NAME': BASE_DIR / f'db.shard_{shard}.sqlite3'}
+
+DATABASE_ROUTERS = ['game.routers.GameShardRouter', 'game.routers.ReplicaRouter']
+
+# Applied on every new SQLite connection (see game.signals.sqlite_connection_setup).
+# WAL lets readers work while a writer is active. The lock timeout is the 'timeout' option of DATABASES.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 134217728,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+}
+
+# Derived game data (see game.cache.cached_for_game). Use a shared backend (e.g. Redis) with several workers,
+# otherwise a worker may not see the version bumps made by the others. ETags are read from the database instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bleff',
+        'TIMEOUT': 300,
     }
 }
 
@@ -136,6 +195,86 @@ LOGIN_URL = '/users/login/'
 
 CHOICES_PER_HAND = 5
 
+# File written by 'compile_dictionary' (e.g. BASE_DIR / 'dictionary.bin'). When it exists, choices are drawn
+# and meanings read from it instead of the database. Compile it again after changing words or meanings: until
+# then, choices of deleted words are drawn again from the database, but edited meanings are shown as compiled.
+COMPILED_DICTIONARY = os.environ.get('BLEFF_COMPILED_DICTIONARY')
+
+# Process-local LRU cache of finished hands details. Its hits, misses and size are on /game/metrics.
+FINISHED_HAND_CACHE = {
+    'max_entries': 2048,
+    'max_bytes': 16 * 1024 * 1024,
+}
+
+# Process-local LRU cache of meanings. Each process only sees its own invalidations, the ttl (seconds)
+# bounds how long the others keep an edited meaning.
+MEANING_CACHE = {
+    'max_entries': 10000,
+    'ttl': 600,
+}
+
+# Time and queries of every receiver in game.signals (see game.instrumentation). It can be switched at runtime
+# from /game/debug/receivers, 'log' writes one line per call to the 'game.receivers' logger.
+RECEIVER_INSTRUMENTATION = {
+    'enabled': False,
+    'log': False,
+}
+
+# Every request is measured (see game.middleware). The measures go back in a Server-Timing header with DEBUG,
+# to staff, or to everyone with BLEFF_SERVER_TIMING=1. This share of the requests is also written to the
+# 'game.performance' logger, to a rotating file when BLEFF_PERFORMANCE_LOG is set.
+SERVER_TIMING = bool(os.environ.get('BLEFF_SERVER_TIMING'))
+PERFORMANCE_LOG_SAMPLE_RATE = float(os.environ.get('BLEFF_PERFORMANCE_SAMPLE_RATE', 0.01))
+
+if os.environ.get('BLEFF_PERFORMANCE_LOG'):
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'performance': {
+                'class': 'logging.handlers.RotatingFileHandler',
+                'filename': os.environ['BLEFF_PERFORMANCE_LOG'],
+                'maxBytes': 10 * 1024 * 1024,
+                'backupCount': 5,
+                'delay': True,
+            },
+        },
+        'loggers': {
+            'game.performance': {'handlers': ['performance'], 'level': 'INFO', 'propagate': False},
+        },
+    }
+
+# Requests and consumer messages that run the same query shape more than 'threshold' times are logged to the
+# 'game.nplusone' logger (see game.nplusone). In strict mode they fail, e.g. BLEFF_NPLUSONE_STRICT=1 on the tests.
+N_PLUS_ONE = {
+    'enabled': DEBUG or bool(os.environ.get('BLEFF_NPLUSONE_STRICT')),
+    'threshold': int(os.environ.get('BLEFF_NPLUSONE_THRESHOLD', 5)),
+    'strict': bool(os.environ.get('BLEFF_NPLUSONE_STRICT')),
+}
+
+# Spans from the views, through the receivers, to every GameConsumer that delivers their events (see
+# game.tracing), written as JSON lines to this file. 'python manage.py trace_report' reads it.
+TRACING = {
+    'file': os.environ.get('BLEFF_TRACE_FILE'),
+}
+
+# Counters and histograms of game.metrics, served by /game/metrics. Each worker writes its own to a file of
+# 'dir' (from a thread, every 'flush_interval' seconds) and the endpoint adds them up, without it only the worker
+# that answers is counted.
+METRICS = {
+    'dir': os.environ.get('BLEFF_METRICS_DIR'),
+    'flush_interval': 5,
+}
+
+# /game/metrics is for staff, and for scrapers that send this token ('Authorization: Bearer <token>').
+METRICS_TOKEN = os.environ.get('BLEFF_METRICS_TOKEN')
+
+# Game actions are appended to this file (see game.capture), 'python manage.py replay_capture' runs them again
+# against a fresh database.
+CAPTURE = {
+    'file': os.environ.get('BLEFF_CAPTURE_FILE'),
+}
+
 # Channels
 ASGI_APPLICATION = "bleff.asgi.application"
 CHANNEL_LAYERS = {
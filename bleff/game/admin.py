@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Game, HandGuess, Vote, Word, Meaning, Language, Play, Hand, Guess, Condition, ConditionTag
+from .models import Game, HandGuess, Vote, Word, Meaning, Language, Play, Hand, Guess, Condition, ConditionTag, GameArchive
 
 class PlayInLine(admin.TabularInline):
     model = Play
@@ -57,4 +57,9 @@ class ConditionTagAdmin(admin.ModelAdmin):
 
 @admin.register(HandGuess)
 class ConditionTagAdmin(admin.ModelAdmin):
-    inlines = [VoteInLine]
\ No newline at end of file
+    inlines = [VoteInLine]
+
+@admin.register(GameArchive)
+class GameArchiveAdmin(admin.ModelAdmin):
+    readonly_fields = ['game', 'created_at']
+    exclude = ['data']
@@ -0,0 +1,136 @@
+import json
+import zlib
+from django.conf import settings
+from django.db import transaction, router, connections
+
+from .models import Game, Hand, Guess, HandGuess, Vote, Choice, Meaning, GameArchive, ArchivedHand
+from .utils import players_points, get_game_users
+
+
+def snapshot_hand(hand: Hand, word_translation: str | None = None) -> dict:
+    '''
+        Guesses (with their votes count) and votes of hand, as plain data.
+    '''
+    hand_guesses = HandGuess.objects.filter(hand=hand).select_related('guess__writer')
+    votes = Vote.objects.filter(to__hand=hand).select_related('user', 'to__guess')
+
+    return {
+        'id': hand.id,
+        'word': hand.word.word if hand.word else None,
+        'word_translation': word_translation,
+        'finished_at': hand.finished_at.isoformat() if hand.finished_at else None,
+        'guesses': [
+            {
+                'content': hg.guess.content,
+                'writer': hg.guess.writer.username,
+                'votes': sum(1 for v in votes if v.to_id == hg.id),
+            }
+            for hg in hand_guesses if hg.guess.writer
+        ],
+        'votes': [{'to': {'guess': {'content': v.to.guess.content}}, 'user': v.user.username} for v in votes],
+    }
+
+
+def snapshot_game(game: Game) -> dict:
+    '''
+        Everything 'hand_detail' shows for every hand of game, as plain data.
+    '''
+    meanings = dict(Meaning.objects.filter(language=game.idiom_id).values_list('word_id', 'word_translation'))
+    hands = {}
+    points = players_points(game_id=game.id)
+
+    for hand in Hand.objects.filter(game=game).select_related('word').order_by('created_at'):
+        hands[str(hand.id)] = snapshot_hand(hand=hand, word_translation=meanings.get(hand.word_id))
+
+    return {
+        'game': {
+            'id': game.id,
+            'finished_at': game.finished_at.isoformat() if game.finished_at else None,
+            'creator': {'id': game.creator.id, 'username': game.creator.username} if game.creator else None,
+        },
+        'points': [{'user': user.username, 'value': points.get(user.id, 0)} for user in get_game_users(game_id=game.id)],
+        'hands': hands,
+    }
+
+
+def archive_game(game: Game) -> GameArchive:
+    '''
+        Stores game as one compressed snapshot and deletes its hands, guesses, handguesses, votes and choices.
+        Plays and conditions are kept, they are small and tell who played what. See archive_finished_games.
+    '''
+    snapshot = snapshot_game(game)
+    db = router.db_for_write(GameArchive, instance=game)
+
+    with transaction.atomic(using=db):
+        archive = GameArchive.objects.using(db).create(game=game, data=zlib.compress(json.dumps(snapshot).encode()))
+        ArchivedHand.objects.using(db).bulk_create([ArchivedHand(id=int(hand_id), archive=archive) for hand_id in snapshot['hands']])
+
+        delete_hands(db, game.id)
+
+    return archive
+
+
+def delete_hands(db: str, game_id: int):
+    '''
+        Deletes the hands of game_id and their rows with one plain DELETE per table. It skips the per row signals:
+        the counters they keep belong to hands that are going away.
+    '''
+    quote = connections[db].ops.quote_name
+
+    def column(model, field: str) -> str:
+        return f'{quote(model._meta.db_table)}.{quote(model._meta.get_field(field).column)}'
+
+    def ids(model, field: str, values: str) -> str:
+        return f'SELECT {column(model, "id")} FROM {quote(model._meta.db_table)} WHERE {column(model, field)} IN ({values})'
+
+    hands = ids(Hand, 'game', '%s')
+    hand_guesses = ids(HandGuess, 'hand', hands)
+
+    with connections[db].cursor() as cursor:
+        for model, field, values in [
+            (Vote, 'to', hand_guesses),
+            (HandGuess, 'hand', hands),
+            (Choice, 'hand', hands),
+            (Guess, 'hand', hands),
+            (Hand, 'game', '%s'),
+        ]:
+            cursor.execute(f'DELETE FROM {quote(model._meta.db_table)} WHERE {column(model, field)} IN ({values})', [game_id])
+
+
+def archive_finished_games(limit: int | None = None) -> int:
+    '''
+        Archives the finished games that are not archived yet, in every shard. Returns how many were archived.
+        It runs out of the requests, with 'python manage.py archive_games' (from cron, or as a worker with --every).
+    '''
+    archived = 0
+
+    for db in settings.GAME_SHARDS or ['default']:
+        games = Game.objects.using(db).filter(finished_at__isnull=False, gamearchive__isnull=True).order_by('finished_at')
+
+        for game in games[:limit - archived] if limit else games:
+            archive_game(game)
+            archived += 1
+
+    return archived
+
+
+def archived_hand_context(hand_id: int) -> dict | None:
+    '''
+        'hand_detail' context for an archived hand, or None if hand_id was not archived.
+    '''
+    archived = ArchivedHand.objects.filter(id=hand_id).select_related('archive').first()
+
+    if not archived:
+        return None
+
+    snapshot = archived.archive.load()
+    hand = snapshot['hands'][str(hand_id)]
+
+    return {
+        'hand': {**hand, 'game': snapshot['game']},
+        'votes': hand['votes'],
+        'guesses': hand['guesses'],
+        'game_id': snapshot['game']['id'],
+        'word': hand['word_translation'],
+        'points': snapshot['points'],
+    }
@@ -0,0 +1,55 @@
+import copy
+import os
+import tempfile
+from contextlib import contextmanager
+from django.db import connections
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+
+# Alias of the configured database while a throwaway one is used.
+SOURCE = 'throwaway_source'
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def count_queries(captured: CaptureQueriesContext) -> int:
+    # Savepoints are not queries the rules make, they depend on the caller's transaction.
+    return sum(1 for query in captured.captured_queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT')))
+
+
+@contextmanager
+def throwaway_database(aliases: tuple[str, ...] = ('default',)):
+    '''
+        Runs the block against new test databases (for 'default' and the other aliases given), migrated and removed
+        afterwards, so nothing is written to the configured ones. The configured 'default' can still be read through
+        the SOURCE alias (e.g. to copy its reference data).
+    '''
+    source = copy.deepcopy(connections.databases['default'])
+    aliases = ['default'] + [alias for alias in aliases if alias != 'default']
+    names = {}
+    directory = tempfile.TemporaryDirectory()
+
+    for alias in aliases:
+        database = connections.databases[alias]
+        test = database.setdefault('TEST', {})
+        names[alias] = test.get('NAME')
+
+        # In memory, SQLite fails at once when another thread (e.g. a consumer's) holds a table, in a file it waits.
+        if 'sqlite3' in database['ENGINE'] and not test.get('NAME'):
+            test['NAME'] = os.path.join(directory.name, f'throwaway_{alias}.sqlite3')
+
+    old_config = setup_databases(verbosity=0, interactive=False, aliases=aliases)
+    connections.databases[SOURCE] = source
+
+    try:
+        yield SOURCE
+    finally:
+        connections[SOURCE].close()
+        del connections.databases[SOURCE]
+        teardown_databases(old_config, verbosity=0)
+
+        for alias, name in names.items():
+            connections.databases[alias]['TEST']['NAME'] = name
+        directory.cleanup()
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .routers import reading_replica
+
+
+class LRUCache:
+    '''
+        Process-local, thread-safe LRU cache limited by number of entries and by (approximate) size in bytes.
+        Values must be JSON serialisable plain data, their size is measured as the length of their JSON.
+        With a ttl (in seconds) entries also expire, which bounds how stale other processes' copies can get.
+    '''
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int | None = None, ttl: float | None = None) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key, default=None) -> Any:
+        with self.lock:
+            if key in self.entries and self.ttl and self.entries[key][2] < time.monotonic():
+                self._pop(key)
+
+            if not key in self.entries:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+
+    def set(self, key, value):
+        size = len(json.dumps(value, default=str))
+
+        with self.lock:
+            if self.max_bytes and size > self.max_bytes:
+                return
+
+            self._pop(key)
+            self.entries[key] = (value, size, time.monotonic() + self.ttl if self.ttl else None)
+            self.size += size
+
+            while len(self.entries) > self.max_entries or (self.max_bytes and self.size > self.max_bytes):
+                self._pop(next(iter(self.entries)))
+
+
+    def delete(self, key):
+        with self.lock:
+            self._pop(key)
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+
+    def _pop(self, key):
+        if key in self.entries:
+            _, size, _ = self.entries.pop(key)
+            self.size -= size
+
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+        }
+
+
+# Context of finished hands for 'hand_detail', keyed by hand id. They never change once finished,
+# so entries are only removed by eviction or by edits made afterwards (e.g. from the admin).
+finished_hands = LRUCache(**getattr(settings, 'FINISHED_HAND_CACHE', {}))
+
+# Meanings keyed by (word id, language tag), see utils.get_meanings.
+meanings = LRUCache(**getattr(settings, 'MEANING_CACHE', {}))
+
+
+def game_version_key(game_id: int) -> str:
+    return f'game:{game_id}:version'
+
+
+def game_version(game_id: int) -> int:
+    '''
+        Current version of game's cache namespace. A missing (or evicted) version starts from the clock,
+        so it never goes back to a number used before.
+    '''
+    return cache.get_or_set(game_version_key(game_id), time.time_ns, timeout=None)
+
+
+def bump_game_version(game_id: int):
+    '''
+        Invalidates everything cached for game in O(1): old keys are not read anymore and expire on their own.
+    '''
+    try:
+        cache.incr(game_version_key(game_id))
+    except ValueError:
+        cache.add(game_version_key(game_id), time.time_ns(), timeout=None)
+
+
+def game_key(game_id: int, name: str) -> str:
+    return f'game:{game_id}:v{game_version(game_id)}:{name}'
+
+
+def cached_for_game(game_id: int, name: str, builder: Callable[[], Any], timeout=DEFAULT_TIMEOUT) -> Any:
+    '''
+        Returns the value cached as name in game's namespace, building (and caching) it if there isn't one.
+        A value built from the replica is not cached, it may lag behind the version it would be cached for.
+    '''
+    key = game_key(game_id, name)
+    value = cache.get(key)
+
+    if value is None:
+        value = builder()
+        if not reading_replica():
+            cache.set(key, value, timeout)
+
+    return value
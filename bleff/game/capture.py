@@ -0,0 +1,191 @@
+import json
+import threading
+import time
+from urllib.parse import urlparse
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, resolve, Resolver404
+
+from .models import Hand, Guess, Choice
+from .utils import get_game_hand
+
+# Views that are not game actions.
+IGNORED_VIEWS = {'game:metrics', 'game:receiver_stats'}
+
+
+class CaptureFile:
+    '''
+        Appends every action as one compact JSON line. The keys are:
+        t (start, epoch seconds), u (username), m (method), v (view name), k (url kwargs), d (POST data),
+        s (status), r (references, see references) and c (id of the game created by the action).
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+
+
+    def write(self, action: dict):
+        line = json.dumps(action, separators=(',', ':')) + '\n'
+
+        with self.lock, open(self.path, 'a') as file:
+            file.write(line)
+
+
+_capture_file = None
+
+
+def capture_file() -> CaptureFile | None:
+    '''
+        The file of settings.CAPTURE['file'], None when capture is off.
+    '''
+    global _capture_file
+    path = getattr(settings, 'CAPTURE', {}).get('file')
+
+    if not path:
+        return None
+    elif not _capture_file or _capture_file.path != path:
+        _capture_file = CaptureFile(path)
+
+    return _capture_file
+
+
+def references(view: str, kwargs: dict, data: dict) -> dict:
+    '''
+        What the ids of an action point to, so it can be replayed in a database where they are other ids: the
+        chosen word by its place among the choices, guesses by their writer and hands by their place in the game.
+        They are read before the action runs.
+    '''
+    game_id = kwargs.get('game_id')
+
+    if view == 'game:choose' and 'choice' in data:
+        words = sorted(Choice.objects.filter(hand=get_game_hand(game_id=game_id)).values_list('word__word', flat=True))
+        return {'choice': words.index(data['choice'])} if data['choice'] in words else {}
+    elif view == 'game:check_guesses' and data:
+        writers = dict(Guess.objects.filter(hand=get_game_hand(game_id=game_id)).values_list('id', 'writer__username'))
+        return {'checks': [[writers.get(int(key)), value] for key, value in data.items() if key.isdigit()]}
+    elif view == 'game:vote' and data.get('guess', '').isdigit():
+        guess = Guess.objects.filter(pk=data['guess']).values('writer__username', 'is_original').first()
+        return {'guess': {'original': True} if guess and guess['is_original'] else {'writer': guess and guess['writer__username']}}
+    elif view == 'game:hand_detail':
+        hand = Hand.objects.filter(pk=kwargs['hand_id']).values('game_id', 'created_at').first()
+        if hand:
+            return {'hand': [hand['game_id'], Hand.objects.filter(game_id=hand['game_id'], created_at__lt=hand['created_at']).count()]}
+
+    return {}
+
+
+def created_game(location: str) -> int | None:
+    '''
+        Id of the game a create_game response redirects to (its Location).
+    '''
+    try:
+        return resolve(urlparse(location).path).kwargs.get('game_id')
+    except Resolver404:
+        return None
+
+
+class Replayer:
+    '''
+        Runs captured actions again, one after the other, each one by a client logged in as its user. Games
+        created by the actions are mapped to the games they create now, and the references of every action
+        are resolved in the current database. Actions on games that were not created in the capture are skipped.
+        With speed 1 the actions keep their original pace, with 10 they go 10 times faster and with 0 as fast
+        as possible.
+    '''
+
+    def __init__(self, speed: float = 1) -> None:
+        self.speed = speed
+        self.games = {}
+        self.clients = {}
+        self.results = {}
+
+
+    def client(self, username: str | None) -> Client:
+        if not username in self.clients:
+            self.clients[username] = Client()
+
+            if username:
+                user, _ = User.objects.get_or_create(username=username)
+                self.clients[username].force_login(user)
+
+        return self.clients[username]
+
+
+    def request(self, action: dict) -> tuple[str, dict] | None:
+        '''
+            Path and data of the action in this database, None if it can't be replayed.
+        '''
+        kwargs, data, refs = dict(action['k']), dict(action['d']), action['r']
+
+        if 'game_id' in kwargs:
+            if not kwargs['game_id'] in self.games:
+                return None
+            kwargs['game_id'] = self.games[kwargs['game_id']]
+
+        if 'hand_id' in kwargs:
+            game, index = refs.get('hand', (None, None))
+            hand_id = Hand.objects.filter(game_id=self.games.get(game)).order_by('created_at').values_list('id', flat=True)[index:index + 1].first() if game in self.games else None
+            if not hand_id:
+                return None
+            kwargs['hand_id'] = hand_id
+
+        if action['v'] == 'game:enter_game' and 'game' in data:
+            if not int(data['game']) in self.games:
+                return None
+            data['game'] = self.games[int(data['game'])]
+        elif 'choice' in refs:
+            words = sorted(Choice.objects.filter(hand=get_game_hand(game_id=kwargs['game_id'])).values_list('word__word', flat=True))
+            if not words:
+                return None
+            data['choice'] = words[refs['choice'] % len(words)]
+        elif 'checks' in refs:
+            guesses = dict(Guess.objects.filter(hand=get_game_hand(game_id=kwargs['game_id'])).values_list('writer__username', 'id'))
+            data = {str(guesses[writer]): value for writer, value in refs['checks'] if writer in guesses}
+        elif 'guess' in refs:
+            guesses = Guess.objects.filter(hand=get_game_hand(game_id=kwargs['game_id']))
+            guesses = guesses.filter(is_original=True) if refs['guess'].get('original') else guesses.filter(writer__username=refs['guess'].get('writer'))
+            data['guess'] = guesses.values_list('id', flat=True).first()
+            if not data['guess']:
+                return None
+
+        return reverse(action['v'], kwargs=kwargs), data
+
+
+    def replay(self, actions: list[dict]):
+        start = time.perf_counter()
+        first = actions[0]['t'] if actions else 0
+
+        for action in actions:
+            if self.speed:
+                wait = (action['t'] - first) / self.speed - (time.perf_counter() - start)
+                if wait > 0:
+                    time.sleep(wait)
+
+            result = self.results.setdefault(f"{action['m']} {action['v']}", {'latencies': [], 'queries': 0, 'skipped': 0, 'diverged': 0})
+            request = self.request(action)
+            if not request:
+                result['skipped'] += 1
+                continue
+
+            path, data = request
+            client = self.client(action['u'])
+
+            with CaptureQueriesContext(connection) as queries:
+                began = time.perf_counter()
+                response = client.post(path, data) if action['m'] == 'POST' else client.get(path, data)
+                result['latencies'].append(time.perf_counter() - began)
+
+            result['queries'] += len(queries)
+            # The same action answered otherwise, e.g. a redirection because the game is in another state.
+            result['diverged'] += response.status_code != action['s']
+
+            if action.get('c'):
+                created = created_game(response.get('Location', ''))
+                if created:
+                    self.games[action['c']] = created
+
+        self.elapsed = time.perf_counter() - start
@@ -1,9 +1,36 @@
 # chat/consumers.py
 import json
+import time
+from functools import wraps
 from asgiref.sync import async_to_sync
 from channels.generic.websocket import WebsocketConsumer
 from django.urls import reverse
 
+from .nplusone import detect_n_plus_one
+from .tracing import span, extracted
+from .metrics import websockets_open
+
+def observed(handler):
+    '''
+        Runs an event handler looking for N+1 queries and, for events sent with a trace (see tracing.inject),
+        in a span of that trace.
+    '''
+    @wraps(handler)
+    def wrapper(self, event):
+        with detect_n_plus_one(f"{self.__class__.__name__} {event['type']}"):
+            trace = extracted(event)
+
+            if not trace:
+                return handler(self, event)
+
+            # The span ends once this client was sent the event, 'notified_ms' counts from the action that sent it.
+            with span(f"consumer.{event['type']}", parent=trace, game_id=int(self.game_id), queued_ms=round((time.time() - trace['sent_at']) * 1000, 3)) as delivery:
+                handler(self, event)
+                delivery.attributes['notified_ms'] = round((time.time() - trace['trace_start']) * 1000, 3)
+
+    return wrapper
+
+
 class GameConsumer(WebsocketConsumer):
     def connect(self):
         self.game_id = self.scope['url_route']['kwargs']['game_id']
@@ -14,42 +41,52 @@ class GameConsumer(WebsocketConsumer):
         )
 
         self.accept()
+        websockets_open.inc(game=self.game_id)
 
 
     def disconnect(self, close_code):
+        websockets_open.dec(game=self.game_id)
+
         async_to_sync(self.channel_layer.group_discard)(
             self.game_name, self.channel_name
         )
 
 
+    @observed
     def start_game(self, event):
         game_id = int(self.game_id)
         self.send(text_data=json.dumps({"start_game": True, "url": reverse('game:hand', args=(game_id,))}))
 
 
+    @observed
     def player_join(self, event):
         player_username = event['player_username']
 
         self.send(text_data=json.dumps({"player_username": player_username}))
 
 
+    @observed
     def chosen_word(self, event):
         self.send(text_data=json.dumps({"chosen_word": True}))
 
 
+    @observed
     def new_guess(self, event):
         new_guess = event['new_guess']
-        self.send(text_data=json.dumps({"new_guess": new_guess}))
+        self.send(text_data=json.dumps({"new_guess": new_guess, "progress": event.get('progress')}))
 
 
+    @observed
     def new_vote(self, event):
             new_vote = event['new_vote']
-            self.send(text_data=json.dumps({"new_vote": new_vote}))
+            self.send(text_data=json.dumps({"new_vote": new_vote, "progress": event.get('progress')}))
 
 
+    @observed
     def guesses_ready(self, event):
         self.send(text_data=json.dumps({"guesses_ready": True}))
 
 
+    @observed
     def hand_finished(self, event):
         self.send(text_data=json.dumps({"hand_finished": True}))
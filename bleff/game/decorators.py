@@ -3,6 +3,7 @@ from django.http import HttpResponseRedirect
 from django.urls import reverse
 
 from .utils import plays_game, get_game_hand, conditions_are_met
+from .routers import use_replica
 
 def play_required(handler):
     def decorator(view_func):
@@ -48,4 +49,19 @@ def conditions_met(handler):
             return view_func(request, *args, **kwargs)
         
         return _wrapped_view
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+def replica_reads(pinned):
+    '''
+        Runs the view reading from the replica database, unless pinned(request, **kwargs) is True.
+        'pinned' should be True when the view shows the acting user's current hand, so they read their own writes.
+    '''
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            with use_replica(not pinned(request, **kwargs)):
+                return view_func(request, *args, **kwargs)
+        
+        return _wrapped_view
+    return decorator
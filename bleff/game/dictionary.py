@@ -0,0 +1,171 @@
+import mmap
+import os
+import random
+import struct
+from collections import namedtuple
+from django.conf import settings
+
+from .models import Language, Word, Meaning
+
+# Compiled dictionary: a read-only file with every Word, Language and Meaning, mapped in memory by every worker.
+# The pages are shared by the processes, so there is no per-process copy and lookups don't touch the database.
+#
+# Layout (little endian):
+#     header    magic, version, languages count, max word id, meanings count and the offset of every section.
+#     languages tag (12 bytes, utf-8), where its playable words start in 'playable' and how many there are.
+#     index     (max word id + 1) x languages int32: number of the meaning record of (word, language), -1 if none.
+#     records   for every meaning, offset and length in 'heap' of the word, its translation and its text.
+#     playable  ids of the words with a meaning, grouped by language.
+#     heap      utf-8 strings.
+
+MAGIC = b'BLFD'
+VERSION = 1
+HEADER = struct.Struct('<4sIIII5Q')
+LANGUAGE = struct.Struct('<12sII')
+RECORD = struct.Struct('<QIQIQI')
+INT = struct.Struct('<i')
+
+DictionaryMeaning = namedtuple('DictionaryMeaning', ['word', 'word_translation', 'text'])
+
+
+def compile_dictionary(path: str) -> dict:
+    '''
+        Writes the compiled dictionary to path (replacing it atomically, workers keep the file they mapped).
+        Returns how many languages, words and meanings it has.
+    '''
+    tags = list(Language.objects.order_by('tag').values_list('tag', flat=True))
+    language_index = {tag: i for i, tag in enumerate(tags)}
+    words = dict(Word.objects.values_list('id', 'word'))
+    max_word_id = max(words, default=0)
+
+    heap = bytearray()
+    strings = {}
+
+    def store(value: str) -> tuple[int, int]:
+        # Words are repeated in every language they have a meaning in, they are stored once.
+        if not value in strings:
+            encoded = value.encode()
+            strings[value] = (len(heap), len(encoded))
+            heap.extend(encoded)
+        return strings[value]
+
+    index = [-1] * ((max_word_id + 1) * len(tags))
+    records = bytearray()
+    playable = {tag: [] for tag in tags}
+    count = 0
+
+    for word_id, tag, translation, text in Meaning.objects.order_by('language', 'word').values_list('word_id', 'language_id', 'word_translation', 'text').iterator():
+        index[word_id * len(tags) + language_index[tag]] = count
+        records.extend(RECORD.pack(*store(words[word_id]), *store(translation), *store(text)))
+        playable[tag].append(word_id)
+        count += 1
+
+    languages = bytearray()
+    start = 0
+    for tag in tags:
+        languages.extend(LANGUAGE.pack(tag.encode(), start, len(playable[tag])))
+        start += len(playable[tag])
+
+    sections = [languages, struct.pack(f'<{len(index)}i', *index), records, struct.pack(f'<{start}i', *[w for tag in tags for w in playable[tag]]), heap]
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(tags), max_word_id, count, *offsets))
+        for section in sections:
+            file.write(section)
+
+    os.replace(temporary, path)
+
+    return {'languages': len(tags), 'words': len(words), 'meanings': count}
+
+
+class CompiledDictionary:
+    '''
+        Read-only view of a compiled dictionary file. Meanings are found in O(1) by (word id, language tag).
+    '''
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n_languages, self.max_word_id, self.n_meanings, *offsets = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a compiled dictionary (version {VERSION})')
+
+        self.languages_offset, self.index_offset, self.records_offset, self.playable_offset, self.heap_offset = offsets
+        self.languages = {}
+
+        for i in range(self.n_languages):
+            tag, start, count = LANGUAGE.unpack_from(self.buffer, self.languages_offset + i * LANGUAGE.size)
+            self.languages[tag.rstrip(b'\0').decode()] = (i, start, count)
+
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self.heap_offset + offset
+        return self.buffer[start:start + length].decode()
+
+
+    def meaning(self, word_id: int, language: str) -> DictionaryMeaning | None:
+        if not language in self.languages or not 0 <= word_id <= self.max_word_id:
+            return None
+
+        position = self.index_offset + (word_id * self.n_languages + self.languages[language][0]) * INT.size
+        record = INT.unpack_from(self.buffer, position)[0]
+
+        if record < 0:
+            return None
+
+        values = RECORD.unpack_from(self.buffer, self.records_offset + record * RECORD.size)
+
+        return DictionaryMeaning(*(self._string(values[i], values[i + 1]) for i in range(0, 6, 2)))
+
+
+    def playable_count(self, language: str) -> int:
+        return self.languages[language][2] if language in self.languages else 0
+
+
+    def sample(self, language: str, k: int, exclude: set = frozenset()) -> list[int]:
+        '''
+            Up to k different random ids of words with a meaning in language, none of them in exclude.
+        '''
+        _, start, count = self.languages.get(language, (0, 0, 0))
+        available = count - len(exclude)
+
+        # Random positions are cheap, the ids are only read for the positions drawn.
+        if k >= available or available <= count // 2:
+            ids = [INT.unpack_from(self.buffer, self.playable_offset + (start + i) * INT.size)[0] for i in range(count)]
+            ids = [i for i in ids if not i in exclude]
+            return random.sample(ids, min(k, len(ids)))
+
+        chosen = set()
+        while len(chosen) < k:
+            word_id = INT.unpack_from(self.buffer, self.playable_offset + (start + random.randrange(count)) * INT.size)[0]
+            if not word_id in exclude:
+                chosen.add(word_id)
+
+        return list(chosen)
+
+
+    def close(self):
+        self.buffer.close()
+
+
+_dictionaries = {}
+
+
+def get_dictionary() -> CompiledDictionary | None:
+    '''
+        The dictionary at settings.COMPILED_DICTIONARY, mapped once per process. None if it is not configured
+        or was not compiled yet.
+    '''
+    path = getattr(settings, 'COMPILED_DICTIONARY', None)
+
+    if path and not path in _dictionaries and os.path.exists(path):
+        _dictionaries[path] = CompiledDictionary(path)
+
+    return _dictionaries.get(path)
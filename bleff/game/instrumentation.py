@@ -0,0 +1,119 @@
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from functools import wraps
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import signals as model_signals
+
+from .tracing import span
+
+logger = logging.getLogger('game.receivers')
+
+SIGNALS = {
+    **{name: signal for name, signal in vars(model_signals).items() if isinstance(signal, model_signals.ModelSignal)},
+    'connection_created': connection_created,
+}
+
+
+class ReceiverStats:
+    '''
+        Wall time and queries of every instrumented receiver, by (signal, sender, receiver). Times and queries
+        include the receivers a receiver triggers (e.g. a save inside a post_save receiver).
+    '''
+
+    def __init__(self, enabled: bool = False, log: bool = False) -> None:
+        self.lock = threading.Lock()
+        self.enabled = enabled
+        self.log = log
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.receivers = {}
+
+
+    def add(self, key: tuple[str, str, str], seconds: float, queries: int):
+        with self.lock:
+            calls, total, slowest, total_queries = self.receivers.get(key, (0, 0.0, 0.0, 0))
+            self.receivers[key] = (calls + 1, total + seconds, max(slowest, seconds), total_queries + queries)
+
+
+    def stats(self) -> list[dict]:
+        '''
+            One row for each receiver, the most expensive (in total time) first.
+        '''
+        with self.lock:
+            rows = [
+                {
+                    'signal': signal, 'sender': sender, 'receiver': receiver, 'calls': calls,
+                    'total_ms': total * 1000, 'avg_ms': total * 1000 / calls, 'max_ms': slowest * 1000,
+                    'queries': queries, 'avg_queries': queries / calls,
+                }
+                for (signal, sender, receiver), (calls, total, slowest, queries) in self.receivers.items()
+            ]
+
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+
+receiver_stats = ReceiverStats(**getattr(settings, 'RECEIVER_INSTRUMENTATION', {}))
+
+
+def timed_receiver(func, signal_name: str):
+    '''
+        Wraps func so it runs in a span of the current trace, and its time and queries are added to receiver_stats.
+        When tracing and the stats are off it only checks them.
+    '''
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    def measured(signal, sender, **kwargs):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            for connection in connections.all(initialized_only=True):
+                stack.enter_context(connection.execute_wrapper(count))
+
+            start = time.perf_counter()
+            try:
+                return func(signal=signal, sender=sender, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                key = (signal_name, getattr(sender, '__name__', str(sender)), name)
+                receiver_stats.add(key, elapsed, queries[0])
+
+                if receiver_stats.log:
+                    logger.info(json.dumps({'signal': key[0], 'sender': key[1], 'receiver': key[2], 'ms': round(elapsed * 1000, 3), 'queries': queries[0]}))
+
+    @wraps(func)
+    def wrapper(signal, sender, **kwargs):
+        with span(f'{signal_name} {name}'):
+            if not receiver_stats.enabled:
+                return func(signal=signal, sender=sender, **kwargs)
+
+            return measured(signal, sender, **kwargs)
+
+    return wrapper
+
+
+def receiver(signal, **kwargs):
+    '''
+        Like django.dispatch.receiver, but connects func as a timed_receiver. The wrapper is kept by the signal
+        and its dispatch_uid is func's name, so it is disconnected with
+        signal.disconnect(sender=..., dispatch_uid='game.signals.<func name>').
+    '''
+    def decorator(func):
+        for each in signal if isinstance(signal, (list, tuple)) else [signal]:
+            signal_name = next((name for name, known in SIGNALS.items() if known is each), repr(each))
+            each.connect(timed_receiver(func, signal_name), weak=False, dispatch_uid=f'{func.__module__}.{func.__qualname__}', **kwargs)
+
+        return func
+
+    return decorator
@@ -0,0 +1,175 @@
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from django.conf import settings
+from django.forms import ValidationError
+from django.db import router, transaction
+
+from .models import Game, Play, Hand, Guess, Choice, Word, Meaning
+from .dictionary import get_dictionary
+from .utils import get_meaning
+from .metrics import hands_started, hands_finished
+
+
+class StepTimings:
+    '''
+        How many times each step ran and how long it took in total, across every Hand save of the process.
+    '''
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.steps = {}
+
+
+    def add(self, step: str, seconds: float):
+        with self.lock:
+            count, total = self.steps.get(step, (0, 0.0))
+            self.steps[step] = (count + 1, total + seconds)
+
+
+    def reset(self):
+        with self.lock:
+            self.steps = {}
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                step: {'count': count, 'total_ms': total * 1000, 'avg_ms': total * 1000 / count}
+                for step, (count, total) in self.steps.items()
+            }
+
+
+hand_timings = StepTimings()
+
+
+class HandLifecycle:
+    '''
+        Every rule of a Hand save, run in order by Hand.save against state loaded once:
+
+        - create: only one unfinished hand per game, the leader (by default the next one in the seating) plays
+          the game, players are counted, the seating rotates and the choices are drawn.
+        - choose word: the word is one of the choices and it was not chosen before, then it is added to the
+          game's played words and its original definition becomes a guess.
+        - end (and any other save): a hand can't finish before it starts.
+    '''
+
+    def __init__(self, hand: Hand) -> None:
+        self.hand = hand
+        self.created = hand._state.adding
+        self.timings = {}
+        # Known before saving, the snapshot of previous values is refreshed by the save.
+        self.word_chosen = bool(hand.word_id) and hand.has_changed('word') and hand.previous('word') is None
+        self.finished = bool(hand.finished_at) and hand.previous('finished_at') is None
+        # Rules read from the database the hand is written to, never from a replica.
+        self.db = router.db_for_write(Hand, instance=hand)
+
+
+    def atomic(self):
+        '''
+            Creating a hand or choosing its word writes several rows, they are written together.
+        '''
+        return transaction.atomic(using=self.db) if self.created or self.word_chosen else nullcontext()
+
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+            hand_timings.add(name, self.timings[name])
+
+
+    def before_save(self):
+        hand = self.hand
+
+        if self.created:
+            with self.step('load_game'):
+                self.game = Game.objects.using(self.db).values('seating', 'rotation_index', 'played_words', 'idiom_id').get(pk=hand.game_id)
+                self.players = set(Play.objects.using(self.db).filter(game_id=hand.game_id).values_list('user_id', flat=True))
+
+            with self.step('unfinished_hand'):
+                if Hand.objects.using(self.db).filter(game_id=hand.game_id, finished_at=None).exists():
+                    raise ValidationError('The previus hand must finish before another its created!')
+
+            with self.step('leader'):
+                seating = self.game['seating']
+
+                if not hand.leader_id and seating:
+                    # The game keeps the seat of the next leader, so there is no need to look at previus hands.
+                    hand.leader_id = seating[len(seating) - 1 - self.game['rotation_index'] % len(seating)]
+                elif hand.leader_id and not hand.leader_id in self.players:
+                    raise ValidationError("Leader can't be an User that does not belong")
+
+                hand.players_expected = len(self.players)
+        else:
+            with self.step('leader'):
+                if hand.leader_id and hand.has_changed('leader') and not Play.objects.using(self.db).filter(game_id=hand.game_id, user_id=hand.leader_id).exists():
+                    raise ValidationError("Leader can't be an User that does not belong")
+
+            with self.step('word'):
+                if hand.has_changed('word'):
+                    if not Choice.objects.using(self.db).filter(hand=hand, word_id=hand.word_id).exists():
+                        raise ValidationError('Should exists a choice for this word to set it')
+                    elif hand.previous('word') != None:
+                        raise ValidationError('Hand word can not be changed')
+
+        if hand.finished_at and hand.finished_at < hand.created_at:
+            raise ValidationError('A Hand can not be finished before it starts')
+
+
+    def after_save(self):
+        hand = self.hand
+
+        if self.created:
+            with self.step('rotate_leader'):
+                if hand.leader_id:
+                    hand.game.rotate_after(user_id=hand.leader_id)
+
+            with self.step('choices'):
+                self.create_choices()
+
+            hands_started.inc()
+
+        if self.word_chosen:
+            with self.step('played_word'):
+                hand.game.add_played_word(word_id=hand.word_id)
+
+            with self.step('original_guess'):
+                # Chosen words have a meaning in the game's idiom (see Choice.save), a hand created with its word may not.
+                meaning = get_meaning(hand.word_id, hand.game.idiom_id) or Meaning.objects.filter(word_id=hand.word_id).first()
+                Guess.objects.create(content=meaning.text, is_original=True, hand=hand)
+
+        if self.finished:
+            hands_finished.inc()
+
+
+    def create_choices(self):
+        played = set(self.game['played_words'])
+        dictionary = get_dictionary()
+
+        # The compiled dictionary draws the words without loading every word from the database.
+        if dictionary:
+            sampled = dictionary.sample(self.game['idiom_id'], settings.CHOICES_PER_HAND, exclude=played)
+            # The file may be older than the database: the words deleted since then (or without their meaning) are
+            # left out, and drawn again from the database.
+            word_ids = list(self.playable_words().filter(id__in=sampled).exclude(id__in=played).values_list('id', flat=True))
+            if len(word_ids) < len(sampled):
+                word_ids += self.draw_words(exclude=played | set(word_ids), k=settings.CHOICES_PER_HAND - len(word_ids))
+        else:
+            word_ids = self.draw_words(exclude=played, k=settings.CHOICES_PER_HAND)
+
+        # Every word has a meaning in the idiom and was not played, the rules of Choice.save hold.
+        Choice.objects.using(self.db).bulk_create([Choice(hand=self.hand, word_id=word_id) for word_id in word_ids])
+
+
+    def playable_words(self):
+        return Word.objects.using(self.db).filter(meaning__language=self.game['idiom_id'])
+
+
+    def draw_words(self, exclude: set, k: int) -> list[int]:
+        candidates = list(self.playable_words().exclude(id__in=exclude).values_list('id', flat=True))
+        return random.sample(candidates, min(k, len(candidates)))
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+
+from game.archive import archive_finished_games
+
+
+class Command(BaseCommand):
+    help = "Archives the finished games (see game.archive), once or, with --every, as a worker that keeps doing it."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, help='Seconds between runs, without it the command runs once.')
+        parser.add_argument('--limit', type=int, help='Games archived per run.')
+
+
+    def handle(self, *args, **options):
+        while True:
+            archived = archive_finished_games(limit=options['limit'])
+            self.stdout.write(f'{archived} games archived')
+
+            if not options['every']:
+                return
+
+            time.sleep(options['every'])
@@ -0,0 +1,130 @@
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, close_old_connections
+from django.db.utils import OperationalError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from game.benchmarks import throwaway_database
+from game.models import Game, Play, Hand, Guess, Word, Meaning, Language
+
+
+class LockRetries:
+    '''
+        Connection execute_wrapper that retries statements failing with "database is locked" and counts them.
+    '''
+
+    def __init__(self, retries: int = 10) -> None:
+        self.retries = retries
+        self.count = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+
+    def __call__(self, execute, sql, params, many, context):
+        for attempt in range(self.retries + 1):
+            try:
+                return execute(sql, params, many, context)
+            except OperationalError as e:
+                if not 'locked' in str(e) or attempt == self.retries:
+                    if 'locked' in str(e):
+                        with self.lock:
+                            self.failures += 1
+                    raise
+
+                with self.lock:
+                    self.count += 1
+                time.sleep(0.005 * (attempt + 1))
+
+
+class Command(BaseCommand):
+    help = "Hammers make_guess and vote from many threads and reports throughput and lock retries."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=4)
+        parser.add_argument('--players', type=int, default=6, help='Players per game, leader included.')
+        parser.add_argument('--baseline', action='store_true', help='Use the rollback journal instead of SQLITE_PRAGMAS.')
+
+
+    def handle(self, *args, **options):
+        pragmas = {'journal_mode': 'DELETE'} if options['baseline'] else settings.SQLITE_PRAGMAS
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+        with override_settings(SQLITE_PRAGMAS=pragmas, CHANNEL_LAYERS=layers, ALLOWED_HOSTS=['*']), throwaway_database():
+            games = [self.create_game(i, options['players']) for i in range(options['games'])]
+            connection.close()
+            retries = LockRetries()
+
+            for phase, action in [('make_guess', self.guess), ('vote', self.vote)]:
+                latencies = []
+                threads = [threading.Thread(target=self.run, args=(action, game, user, retries, latencies)) for game in games for user in game['players']]
+
+                start = time.perf_counter()
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                elapsed = time.perf_counter() - start
+
+                latencies.sort()
+                self.stdout.write(
+                    f'{phase}: {len(latencies)} requests in {elapsed:.2f}s '
+                    f'({len(latencies) / elapsed:.1f} req/s, p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, '
+                    f'max {latencies[-1] * 1000:.1f}ms)'
+                )
+
+                if phase == 'make_guess':
+                    for game in games:
+                        self.check_guesses(game)
+
+            self.stdout.write(f'Lock retries: {retries.count}, lock failures: {retries.failures}')
+
+
+    def run(self, action, game, user, retries, latencies):
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(user)
+
+        with connection.execute_wrapper(retries):
+            start = time.perf_counter()
+            action(client, game, user)
+            latencies.append(time.perf_counter() - start)
+
+        close_old_connections()
+        connection.close()
+
+
+    def guess(self, client, game, user):
+        client.post(reverse('game:make_guess', args=[game['game'].id]), data={'guess': f'{user.username} thinks it means something.'})
+
+
+    def vote(self, client, game, user):
+        target = Guess.objects.filter(hand=game['hand'], is_original=True).values_list('id', flat=True).get()
+        client.post(reverse('game:vote', args=[game['game'].id]), data={'guess': target})
+
+
+    def check_guesses(self, game):
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(game['leader'])
+        data = {g.id: False for g in Guess.objects.filter(hand=game['hand'], writer__isnull=False)}
+        client.post(reverse('game:check_guesses', args=[game['game'].id]), data=data)
+
+
+    def create_game(self, index: int, players: int) -> dict:
+        language, _ = Language.objects.get_or_create(tag='en', defaults={'name': 'English'})
+        leader = User.objects.create_user(username=f'bench_{index}_leader', password='benchmark')
+        game = Game.objects.create(idiom=language, creator=leader)
+        users = [User.objects.create_user(username=f'bench_{index}_{i}', password='benchmark') for i in range(players - 1)]
+
+        for user in users:
+            Play.objects.create(game=game, user=user)
+
+        word = Word.objects.create(word=f'bench_word_{index}')
+        Meaning.objects.create(word=word, language=language, word_translation=word.word, text=f'The benchmark word number {index}.')
+        hand = Hand.objects.create(game=game, leader=leader, word=word)
+
+        return {'game': game, 'hand': hand, 'leader': leader, 'players': users}
+
@@ -0,0 +1,67 @@
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from game.models import Game, Play, Hand, Choice, Word, Meaning, Language
+from game.lifecycle import hand_timings
+from game.benchmarks import count_queries, throwaway_database
+
+
+class Command(BaseCommand):
+    help = "Plays hands (create, choose word, end) and reports the queries and time of each Hand save, and of each lifecycle step."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hands', type=int, default=20)
+        parser.add_argument('--players', type=int, default=4)
+
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            game = self.setup(options['players'], options['hands'])
+            hand_timings.reset()
+            results = {'create': [], 'choose': [], 'end': []}
+
+            for _ in range(options['hands']):
+                hand = self.measure(results['create'], lambda: Hand.objects.create(game=game))
+                hand.word = Choice.objects.filter(hand=hand).select_related('word')[0].word
+                self.measure(results['choose'], hand.save)
+                self.measure(results['end'], hand.end)
+
+        for action, measures in results.items():
+            queries = sum(q for q, _ in measures) / len(measures)
+            elapsed = sum(t for _, t in measures) / len(measures)
+            self.stdout.write(f'{action}: {queries:.1f} queries, {elapsed * 1000:.2f}ms per save')
+
+        for step, stats in hand_timings.stats().items():
+            self.stdout.write(f"  {step}: {stats['avg_ms']:.3f}ms ({stats['count']} times)")
+
+
+    def measure(self, results: list, action):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            value = action()
+            elapsed = time.perf_counter() - start
+
+        results.append((count_queries(captured), elapsed))
+        return value
+
+
+    def setup(self, players: int, hands: int) -> Game:
+        language = Language.objects.create(tag='en', name='English')
+
+        # Every hand plays a different word, and every one of them needs its choices.
+        for i in range((hands + 1) * settings.CHOICES_PER_HAND):
+            word = Word.objects.create(word=f'bench_{i}')
+            Meaning.objects.create(word=word, language=language, word_translation=word.word, text='A word used to benchmark hands.')
+
+        users = [User.objects.create(username=f'bench_{p}') for p in range(players)]
+        game = Game.objects.create(idiom=language, creator=users[0])
+        for user in users[1:]:
+            Play.objects.create(game=game, user=user)
+
+        return Game.objects.get(pk=game.pk)
+
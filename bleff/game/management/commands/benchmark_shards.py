@@ -0,0 +1,106 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+
+from game.models import Game, GameSequence, Play, Hand, Guess, HandGuess, Vote, Word, Meaning, Language
+from game.routers import use_shard, replicate
+from game.benchmarks import throwaway_database
+
+LANGUAGE = 'en'
+
+
+def play_hand(players: list, word: Word) -> int:
+    '''
+        Creates a game with its plays, a hand, guesses, checks and votes. Returns the number of rows written.
+    '''
+    leader, others = players[0], players[1:]
+    game_id = GameSequence.objects.create().id
+
+    with use_shard(game_id):
+        game = Game.objects.create(id=game_id, idiom_id=LANGUAGE)
+        for player in players:
+            Play.objects.create(game=game, user=player)
+
+        hand = Hand.objects.create(game=game, leader=leader, word=word)
+        guesses = [Guess.objects.create(hand=hand, writer=player, content=f'{player.username} guess') for player in others]
+
+        for guess in guesses:
+            hg = HandGuess.objects.get(hand=hand, guess=guess)
+            hg.is_correct = False
+            hg.save()
+
+        original = HandGuess.objects.get(hand=hand, guess__is_original=True)
+        for player in others:
+            Vote.objects.create(to=original, user=player)
+
+        hand.end()
+        game.end()
+
+        # Game, plays, hand, original guess and its HandGuess, guesses with their HandGuess, checks and votes.
+        return 1 + len(players) + 1 + 2 + len(others) * 4
+
+
+def play_hands(players: list, games: int, word: Word) -> int:
+    for alias in connections:
+        connections[alias].close()
+
+    return sum(play_hand(players, word) for _ in range(games))
+
+
+class Command(BaseCommand):
+    help = "Plays full hands on 1..N game shards from several processes and reports write throughput for each shard count."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers-per-shard', type=int, default=2)
+        parser.add_argument('--games', type=int, default=10, help='Games played by each worker.')
+        parser.add_argument('--players', type=int, default=4)
+
+
+    def handle(self, *args, **options):
+        shards = list(settings.GAME_SHARDS)
+        if not shards:
+            raise CommandError('There are no game shards configured, set BLEFF_GAME_SHARDS.')
+
+        with throwaway_database(shards):
+            users, word = self.setup(len(shards) * options['workers_per_shard'], options['players'])
+            for alias in shards:
+                replicate(alias)
+
+            baseline = None
+            for n in range(1, len(shards) + 1):
+                with override_settings(GAME_SHARDS=shards[:n]):
+                    writes, elapsed = self.run(n * options['workers_per_shard'], options['games'], users, word)
+
+                throughput = writes / elapsed
+                baseline = baseline or throughput
+                self.stdout.write(f'{n} shard(s): {writes} writes in {elapsed:.2f}s, {throughput:.0f} writes/s ({throughput / baseline:.2f}x)')
+
+
+    def run(self, workers: int, games: int, users: list, word: Word) -> tuple[int, float]:
+        # Processes instead of threads, so the GIL doesn't hide how the databases scale.
+        for alias in connections:
+            connections[alias].close()
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            writes = sum(executor.map(play_hands, [users[i] for i in range(workers)], [games] * workers, [word] * workers))
+
+        return writes, time.perf_counter() - start
+
+
+    def setup(self, workers: int, players: int):
+        language = Language.objects.create(tag=LANGUAGE, name='English')
+        word = Word.objects.create(word='bench')
+        Meaning.objects.create(word=word, language=language, word_translation=word.word, text='A word used to benchmark shards.')
+
+        # Each worker has its own players, a user can't play two unfinished games.
+        users = [[User.objects.create(username=f'bench_{t}_{p}') for p in range(players)] for t in range(workers)]
+
+        return users, word
+
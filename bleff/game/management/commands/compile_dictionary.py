@@ -0,0 +1,26 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from game.dictionary import compile_dictionary
+
+
+class Command(BaseCommand):
+    help = "Writes words, languages and meanings to the compiled dictionary file every worker maps in memory."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.COMPILED_DICTIONARY, help='By default settings.COMPILED_DICTIONARY.')
+
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('There is no output file, set BLEFF_COMPILED_DICTIONARY or use --output.')
+
+        start = time.perf_counter()
+        counts = compile_dictionary(options['output'])
+
+        self.stdout.write(
+            f"{options['output']}: {counts['languages']} languages, {counts['words']} words and {counts['meanings']} meanings "
+            f"in {time.perf_counter() - start:.2f}s. Restart the workers to map the new file."
+        )
@@ -0,0 +1,139 @@
+import csv
+import json
+import time
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from game.models import Language, Word, Meaning
+
+FIELDS = {'word': Word, 'word_translation': Meaning, 'text': Meaning}
+
+
+def read_rows(path: str, format: str):
+    '''
+        Yields (row, line number) from a CSV (with a header) or JSON lines file, one line at a time.
+    '''
+    with open(path, newline='', encoding='utf-8') as file:
+        if format == 'csv':
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield row, reader.line_num
+        else:
+            for number, line in enumerate(file, start=1):
+                if line.strip():
+                    yield parse_json_line(line), number
+
+
+def parse_json_line(line: str) -> dict | None:
+    try:
+        row = json.loads(line)
+    except ValueError:
+        return None
+
+    return row if isinstance(row, dict) else None
+
+
+def clean_row(row: dict) -> dict:
+    '''
+        Row with its fields stripped and validated as the models would, raises ValidationError otherwise.
+    '''
+    if row is None:
+        raise ValidationError('Not a JSON object')
+
+    cleaned = {}
+
+    for name, model in FIELDS.items():
+        value = str(row.get(name) or '').strip()
+        model._meta.get_field(name).clean(value, None)
+        cleaned[name] = value
+
+    return cleaned
+
+
+def import_batch(rows: list[dict], language: Language) -> tuple[int, int]:
+    '''
+        Inserts the words and meanings of rows, ignoring the ones already there. Returns (words, meanings) inserted.
+    '''
+    # The first meaning of a word wins, as it does against the rows already in the database.
+    rows = list({row['word']: row for row in reversed(rows)}.values())
+
+    with transaction.atomic():
+        existing = set(Word.objects.filter(word__in=[row['word'] for row in rows]).values_list('word', flat=True))
+        words = Word.objects.bulk_create([Word(word=row['word']) for row in rows if not row['word'] in existing], ignore_conflicts=True)
+        ids = dict(Word.objects.filter(word__in=[row['word'] for row in rows]).values_list('word', 'id'))
+
+        existing = set(Meaning.objects.filter(language=language, word_id__in=ids.values()).values_list('word_id', flat=True))
+        meanings = Meaning.objects.bulk_create([
+            Meaning(word_id=ids[row['word']], language=language, word_translation=row['word_translation'], text=row['text'])
+            for row in rows if not ids[row['word']] in existing
+        ], ignore_conflicts=True)
+
+        return len(words), len(meanings)
+
+
+class Command(BaseCommand):
+    help = "Imports a dictionary (word, word_translation and text for every row) from a CSV or JSON lines file."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--language', required=True, help='Tag of the language of the meanings.')
+        parser.add_argument('--language-name', help='Creates the language if it does not exist.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='By default taken from the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+
+    def handle(self, *args, **options):
+        language = self.get_language(options['language'], options['language_name'])
+        format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        rows = self.valid_rows(read_rows(options['path'], format))
+
+        read = words = meanings = 0
+        start = time.perf_counter()
+
+        # Only one batch is kept in memory at a time.
+        while batch := list(islice(rows, options['batch_size'])):
+            inserted_words, inserted_meanings = import_batch(batch, language)
+            read += len(batch)
+            words += inserted_words
+            meanings += inserted_meanings
+
+            self.stdout.write(f'{read} rows, {read / (time.perf_counter() - start):.0f} rows/s', ending='\r')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{read} valid rows ({self.invalid} invalid) in {elapsed:.2f}s, {read / elapsed if elapsed else 0:.0f} rows/s. '
+            f'Inserted {words} words and {meanings} meanings.'
+        )
+
+
+    def get_language(self, tag: str, name: str | None) -> Language:
+        language = Language.objects.filter(tag=tag).first()
+
+        if language:
+            return language
+        elif not name:
+            raise CommandError(f"Language '{tag}' does not exist, use --language-name to create it.")
+
+        language = Language(tag=tag, name=name)
+        try:
+            language.full_clean()
+        except ValidationError as e:
+            raise CommandError('; '.join(e.messages))
+
+        language.save()
+
+        return language
+
+
+    def valid_rows(self, rows):
+        self.invalid = 0
+
+        for row, line in rows:
+            try:
+                yield clean_row(row)
+            except ValidationError as e:
+                self.invalid += 1
+                self.stderr.write(f'Line {line}: {"; ".join(e.messages)}')
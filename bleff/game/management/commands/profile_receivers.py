@@ -0,0 +1,31 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from game.instrumentation import receiver_stats
+
+
+class Command(BaseCommand):
+    help = "Runs another command (e.g. 'benchmark_hand_save') with the receivers instrumented and shows their time and queries."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('command')
+        parser.add_argument('arguments', nargs='*')
+        parser.add_argument('--limit', type=int, default=20, help='Receivers shown, the most expensive first.')
+
+
+    def handle(self, *args, **options):
+        receiver_stats.reset()
+        receiver_stats.enabled = True
+
+        try:
+            call_command(options['command'], *options['arguments'], stdout=self.stdout)
+        finally:
+            receiver_stats.enabled = False
+
+        self.stdout.write(f"{'receiver':<55} {'sender':<12} {'signal':<12} {'calls':>6} {'total ms':>9} {'avg ms':>7} {'queries':>8}")
+        for row in receiver_stats.stats()[:options['limit']]:
+            self.stdout.write(
+                f"{row['receiver'].removeprefix('game.signals.'):<55} {row['sender']:<12} {row['signal']:<12} {row['calls']:>6} "
+                f"{row['total_ms']:>9.2f} {row['avg_ms']:>7.3f} {row['avg_queries']:>8.1f}"
+            )
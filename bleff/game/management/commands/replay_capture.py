@@ -0,0 +1,52 @@
+import json
+import random
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from game.capture import Replayer
+from game.cache import finished_hands, meanings
+from game.benchmarks import percentile, throwaway_database
+from game.routers import replicate
+
+
+class Command(BaseCommand):
+    help = "Replays a capture (settings.CAPTURE) against a fresh database, with the reference data of the current one, and reports every endpoint."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--speed', type=float, default=1, help='1 keeps the original pace, 10 is 10 times faster and 0 as fast as possible.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random choices, the same seed replays the same games.')
+
+
+    def handle(self, *args, **options):
+        with open(options['file']) as file:
+            actions = [json.loads(line) for line in file if line.strip()]
+
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+        with override_settings(CAPTURE={}, CHANNEL_LAYERS=layers, ALLOWED_HOSTS=['*']), throwaway_database() as source:
+            self.stdout.write(f'{replicate("default", source=source)} reference rows copied')
+            cache.clear()
+            finished_hands.clear()
+            meanings.clear()
+            random.seed(options['seed'])
+
+            replayer = Replayer(speed=options['speed'])
+            replayer.replay(actions)
+            self.report(replayer, actions)
+
+
+    def report(self, replayer: Replayer, actions: list[dict]):
+        span = actions[-1]['t'] - actions[0]['t'] if actions else 0
+        self.stdout.write(f'{len(actions)} actions captured in {span:.2f}s, replayed in {replayer.elapsed:.2f}s')
+        self.stdout.write(f"{'endpoint':<28} {'requests':>9} {'skipped':>8} {'diverged':>9} {'p50 ms':>9} {'p99 ms':>9} {'queries':>8}")
+
+        for endpoint, result in sorted(replayer.results.items()):
+            latencies = result['latencies'] or [0.0]
+            count = len(result['latencies'])
+            self.stdout.write(
+                f"{endpoint:<28} {count:>9} {result['skipped']:>8} {result['diverged']:>9} {percentile(latencies, 0.5) * 1000:>9.1f} "
+                f"{percentile(latencies, 0.99) * 1000:>9.1f} {result['queries'] / max(count, 1):>8.1f}"
+            )
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.routers import replicate
+
+
+class Command(BaseCommand):
+    help = "Copies users, languages, words, meanings and condition tags from 'default' to every game shard."
+
+
+    def handle(self, *args, **options):
+        if not settings.GAME_SHARDS:
+            self.stdout.write('There are no game shards configured (BLEFF_GAME_SHARDS).')
+            return
+
+        for alias in settings.GAME_SHARDS:
+            self.stdout.write(f'{alias}: {replicate(alias)} rows')
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import random
+import re
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+
+from game.models import Hand, Word, Meaning, Language
+from game.benchmarks import percentile, throwaway_database
+from game.cache import finished_hands, meanings
+from game.capture import created_game
+
+PREFIX = 'sim_'
+
+# Names of the guesses the leader checks, in game/check_guesses.html.
+CHECK_FIELD = re.compile(r'<select id="(\d+)"')
+
+
+class Bot:
+    '''
+        A player with its own session, that only knows the game through the views and its WebSocket.
+    '''
+
+    def __init__(self, user: User, game: dict) -> None:
+        self.user = user
+        self.game = game
+        self.csrf = get_random_string(32)
+
+        client = Client()
+        client.force_login(user)
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; {settings.CSRF_COOKIE_NAME}={self.csrf}'
+        self.wake = asyncio.Event()
+        self.events = 0
+        self.state = None
+        # State reads that found every hand finished.
+        self.done_reads = 0
+
+
+    def headers(self) -> list[tuple[bytes, bytes]]:
+        return [(b'host', b'localhost'), (b'origin', b'http://localhost'), (b'cookie', self.cookie.encode())]
+
+
+class Command(BaseCommand):
+    help = (
+        "Plays N games of M bots through the ASGI application (views and GameConsumer), against a throwaway database, "
+        "and reports throughput, latencies and errors by endpoint."
+    )
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=4)
+        parser.add_argument('--players', type=int, default=4, help='Bots per game, the creator included.')
+        parser.add_argument('--hands', type=int, default=3, help='Hands played in every game.')
+        parser.add_argument('--think', type=float, default=0.1, help='Mean seconds a bot waits before acting.')
+        parser.add_argument('--timeout', type=float, default=300, help='Seconds before the simulation is stopped.')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--channel-layer', choices=['memory', 'settings'], default='memory', help="'settings' uses the configured CHANNEL_LAYERS (e.g. Redis).")
+
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+        layers = settings.CHANNEL_LAYERS if options['channel_layer'] == 'settings' else {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+        with override_settings(CHANNEL_LAYERS=layers, ALLOWED_HOSTS=['*']), throwaway_database():
+            # Loaded here so it uses the channel layer above.
+            from bleff.asgi import application
+            self.application = application
+
+            # The caches hold rows of the configured database.
+            cache.clear()
+            finished_hands.clear()
+            meanings.clear()
+
+            games = [self.create_game(index) for index in range(options['games'])]
+
+            start = time.perf_counter()
+            finished = asyncio.run(self.simulate(games))
+            elapsed = time.perf_counter() - start
+
+            self.report(games, elapsed, finished)
+
+
+    def create_game(self, index: int) -> dict:
+        language, _ = Language.objects.get_or_create(tag='SM', defaults={'name': 'Simulation'})
+
+        # Every hand draws words not played in its game.
+        for i in range((self.options['hands'] + 1) * settings.CHOICES_PER_HAND):
+            word = Word.objects.create(word=f'{PREFIX}{index}_{i}')
+            Meaning.objects.create(word=word, language=language, word_translation=word.word, text=f'Simulated word {i} of game {index}.')
+
+        users = [User.objects.create_user(username=f'{PREFIX}{index}_{p}') for p in range(self.options['players'])]
+        game = {'id': None, 'started': 0, 'finished': set()}
+        game['bots'] = [Bot(user, game) for user in users]
+
+        return game
+
+
+    async def simulate(self, games: list[dict]) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.gather(*[self.play_game(game) for game in games]), timeout=self.options['timeout'])
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+    async def play_game(self, game: dict):
+        creator, *others = game['bots']
+
+        players = self.options['players']
+        response = await self.request(creator, 'POST', 'game:create', data={'language': 'SM', 'MIN_PLAYERS': players, 'MAX_PLAYERS': players})
+        game['id'] = created_game({name.lower(): value for name, value in response['headers']}.get(b'location', b'').decode())
+        if not game['id']:
+            return
+
+        for bot in others:
+            await self.request(bot, 'POST', 'game:enter_game', data={'game': game['id']})
+            await self.request(bot, 'GET', 'game:waiting', game['id'])
+
+        sockets = []
+        for bot in game['bots']:
+            socket = WebsocketCommunicator(self.application, f"/ws/game/{game['id']}/", headers=bot.headers())
+            connected, _ = await socket.connect()
+            if not connected:
+                self.errors['websocket'] += 1
+                continue
+
+            sockets.append((socket, asyncio.create_task(self.listen(socket, bot))))
+
+        try:
+            await asyncio.gather(*[self.play(bot) for bot in game['bots']])
+        finally:
+            for socket, listener in sockets:
+                listener.cancel()
+                await socket.disconnect()
+
+
+    async def listen(self, socket: WebsocketCommunicator, bot: Bot):
+        # Events only wake the bot up, what to do next is read from the game state.
+        while True:
+            await socket.receive_from(timeout=self.options['timeout'])
+            bot.events += 1
+            bot.wake.set()
+
+
+    async def play(self, bot: Bot):
+        game = bot.game
+        game_id = game['id']
+        is_creator = bot is game['bots'][0]
+
+        while True:
+            response = await self.request(bot, 'GET', 'game:state', game_id)
+            if response['status'] != 200:
+                # Already counted as an error, the state is read again after a while.
+                await asyncio.sleep(max(self.options['think'], 0.05))
+                continue
+
+            state = json.loads(response['body'] or b'null')
+            acted = False
+            bot.state = state
+
+            if not state:
+                return
+            elif state['phase'] == 'waiting':
+                # Only hands the server says are finished count, a hand that just started isn't one of them.
+                if state['last_finished_hand_id']:
+                    game['finished'].add(state['last_finished_hand_id'])
+
+                if len(game['finished']) >= self.options['hands']:
+                    # Stops on the second read that finds it, so a single stale state doesn't end the game early.
+                    bot.done_reads += 1
+                    if bot.done_reads == 2:
+                        return
+                elif is_creator and game['started'] == len(game['finished']):
+                    # Only the creator starts the next hand, once the last one finished.
+                    game['started'] += 1
+                    await self.request(bot, 'POST', 'game:start_game', game_id)
+                    acted = True
+            elif state['phase'] == 'choosing' and state['you']['is_leader']:
+                choice = self.random.choice(state['you']['choices'])
+                await self.request(bot, 'POST', 'game:choose', game_id, data={'choice': choice['word']})
+                acted = True
+            elif state['phase'] == 'guessing' and not state['you']['guessed']:
+                await self.request(bot, 'POST', 'game:make_guess', game_id, data={'guess': f"{bot.user.username} thinks hand {state['hand']['id']} means this."})
+                acted = True
+            elif state['phase'] == 'checking' and state['you']['is_leader']:
+                page = await self.request(bot, 'GET', 'game:check_guesses', game_id)
+                checks = {guess_id: 'False' for guess_id in CHECK_FIELD.findall(page['body'].decode())}
+                if checks:
+                    await self.request(bot, 'POST', 'game:check_guesses', game_id, data=checks)
+                    acted = True
+            elif state['phase'] == 'voting' and not state['you']['is_leader'] and not state['you']['voted']:
+                others = [guess for guess in state['hand']['guesses'] if not guess['content'].startswith(bot.user.username + ' ')]
+                await self.request(bot, 'POST', 'game:vote', game_id, data={'guess': self.random.choice(others)['id']})
+                acted = True
+
+            if acted:
+                await asyncio.sleep(self.random.uniform(0, 2 * self.options['think']))
+            else:
+                # Nothing to do until another player acts, an event (or a while) tells when to look again.
+                bot.wake.clear()
+                try:
+                    await asyncio.wait_for(bot.wake.wait(), timeout=max(self.options['think'], 0.05) * 5)
+                except asyncio.TimeoutError:
+                    pass
+
+
+    async def request(self, bot: Bot, method: str, name: str, *args, data: dict | None = None) -> dict:
+        headers = bot.headers()
+        body = b''
+
+        if method == 'POST':
+            body = urlencode(data or {}).encode()
+            headers += [(b'content-type', b'application/x-www-form-urlencoded'), (b'x-csrftoken', bot.csrf.encode())]
+
+        endpoint = f'{method} {name}'
+        start = time.perf_counter()
+        communicator = HttpCommunicator(self.application, method, reverse(name, args=args), body=body, headers=headers)
+        try:
+            response = await communicator.get_response(timeout=self.options['timeout'])
+            # The request is done once the application finished (e.g. its request_finished receivers).
+            await communicator.wait(timeout=self.options['timeout'])
+        except Exception:
+            self.errors[endpoint] += 1
+            return {'status': None, 'body': b''}
+
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if response['status'] >= 400:
+            self.errors[endpoint] += 1
+
+        return response
+
+
+    def report(self, games: list[dict], elapsed: float, finished: bool):
+        requests = sum(len(latencies) for latencies in self.latencies.values())
+        hands = Hand.objects.filter(game__in=[game['id'] for game in games], finished_at__isnull=False).count()
+        events = sum(bot.events for game in games for bot in game['bots'])
+
+        self.stdout.write(
+            f"{len(games)} games, {hands} hands finished, {requests} requests and {events} WebSocket events in {elapsed:.2f}s "
+            f"({requests / elapsed:.1f} req/s){'' if finished else ', stopped by the timeout'}"
+        )
+        self.stdout.write(f"{'endpoint':<28} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+
+        if not finished:
+            for game in games:
+                phases = ', '.join(f"{bot.user.username}: {bot.state and bot.state['phase']}" for bot in game['bots'])
+                self.stdout.write(f"Game {game['id']} ({game['started']} hands started) was left at {phases}")
+
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies.get(endpoint) or [0.0]
+            self.stdout.write(
+                f'{endpoint:<28} {len(self.latencies.get(endpoint, [])):>9} {self.errors[endpoint]:>7} '
+                f'{percentile(latencies, 0.5) * 1000:>9.1f} {percentile(latencies, 0.99) * 1000:>9.1f} {max(latencies) * 1000:>9.1f}'
+            )
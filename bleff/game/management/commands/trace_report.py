@@ -0,0 +1,52 @@
+import json
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from game.benchmarks import percentile
+
+
+class Command(BaseCommand):
+    help = "Reads the spans of settings.TRACING and reports, per game and per action, how long it took to notify every client."
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='Spans file, by default the one of settings.TRACING.')
+
+
+    def handle(self, *args, **options):
+        path = options['file'] or getattr(settings, 'TRACING', {}).get('file')
+        if not path:
+            raise CommandError('There is no spans file, set BLEFF_TRACE_FILE or use --file.')
+
+        traces = defaultdict(list)
+        with open(path) as file:
+            for line in file:
+                span = json.loads(line)
+                traces[span['trace_id']].append(span)
+
+        by_game, by_action = defaultdict(list), defaultdict(list)
+        for spans in traces.values():
+            deliveries = [s for s in spans if s['name'].startswith('consumer.')]
+            if not deliveries:
+                continue
+
+            # An action is done when its last client was notified. Deliveries that failed have no time.
+            notified = max((s['attributes']['notified_ms'] for s in deliveries if 'notified_ms' in s['attributes']), default=None)
+            if notified is None:
+                continue
+
+            root = next((s['name'] for s in spans if not s['parent_id']), 'unknown')
+            by_game[deliveries[0]['attributes']['game_id']].append((notified, len(deliveries)))
+            by_action[root].append((notified, len(deliveries)))
+
+        for title, groups in (('game', by_game), ('action', by_action)):
+            self.stdout.write(f"{title:<40} {'actions':>8} {'clients':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+
+            for key, measures in sorted(groups.items(), key=lambda item: str(item[0])):
+                latencies = [notified for notified, _ in measures]
+                clients = sum(n for _, n in measures) / len(measures)
+                self.stdout.write(
+                    f'{str(key):<40} {len(measures):>8} {clients:>8.1f} {percentile(latencies, 0.5):>9.2f} '
+                    f'{percentile(latencies, 0.99):>9.2f} {max(latencies):>9.2f}'
+                )
@@ -0,0 +1,338 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from django.conf import settings
+from django.db.models import Count
+
+from .models import Game, Play
+from .cache import finished_hands, meanings
+
+logger = logging.getLogger('game.metrics')
+
+# Upper bounds (seconds or counts) of the histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 32)
+
+
+class Registry:
+    '''
+        The samples of this process, as (name, labels) -> value. Every thread adds to its own shard, so an update
+        takes no lock, and reading sums the shards, plus the samples of the collectors (functions returning
+        samples kept elsewhere, read when needed). With settings.METRICS['dir'] a thread of the process also
+        writes its samples to a file of that directory every 'flush_interval' seconds, and the samples of the
+        other workers are read from their files when the metrics are collected.
+    '''
+
+    def __init__(self, dir: str | None = None, flush_interval: float = 5) -> None:
+        self.dir = dir
+        self.flush_interval = flush_interval
+        self.families = {}
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.others = {}
+        self.collectors = []
+        self.flusher = None
+        self.stopped = threading.Event()
+
+        if dir:
+            os.makedirs(dir, exist_ok=True)
+            # A forked worker doesn't have the thread of its parent, it starts its own.
+            os.register_at_fork(after_in_child=self.forget_flusher)
+
+
+    def shard(self) -> dict:
+        try:
+            return self.local.values
+        except AttributeError:
+            # Only the first update of each thread takes the lock.
+            self.local.values = {}
+            with self.lock:
+                self.shards.append(self.local.values)
+
+            return self.local.values
+
+
+    def add(self, name: str, labels: tuple, value: float):
+        values = self.shard()
+        values[(name, labels)] = values.get((name, labels), 0) + value
+
+        if self.dir and not self.flusher:
+            self.start_flusher()
+
+
+    def start_flusher(self):
+        with self.lock:
+            if self.flusher or self.stopped.is_set():
+                return
+
+            self.flusher = threading.Thread(target=self.flush_every_interval, name='metrics-flush', daemon=True)
+            self.flusher.start()
+
+
+    def forget_flusher(self):
+        self.flusher = None
+        self.lock = threading.Lock()
+
+
+    def flush_every_interval(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+
+    def close(self):
+        '''
+            Stops the flushing thread, after one last flush.
+        '''
+        self.stopped.set()
+
+        if self.flusher:
+            self.flusher.join()
+            self.flush()
+
+
+    def samples(self) -> dict:
+        totals = {}
+
+        for values in list(self.shards):
+            for key, value in list(values.items()):
+                totals[key] = totals.get(key, 0) + value
+
+        for collector in self.collectors:
+            for key, value in collector().items():
+                totals[key] = totals.get(key, 0) + value
+
+        return totals
+
+
+    def flush(self):
+        '''
+            Writes the samples of this process. It runs in the flushing thread, and when the metrics are collected
+            within a request, so a failure is logged, not raised.
+        '''
+        path = os.path.join(self.dir, f'metrics-{os.getpid()}.json')
+
+        temporary = None
+
+        with self.lock:
+            try:
+                # Every flush writes its own file, so the readers never see half of one.
+                fd, temporary = tempfile.mkstemp(dir=self.dir, prefix='.metrics-', suffix='.tmp')
+                with os.fdopen(fd, 'w') as file:
+                    json.dump([[name, labels, value] for (name, labels), value in self.samples().items()], file)
+
+                os.replace(temporary, path)
+            except OSError:
+                logger.exception('Metrics could not be written to %s', self.dir)
+
+                if temporary and os.path.exists(temporary):
+                    os.remove(temporary)
+
+
+    def other_samples(self) -> dict:
+        '''
+            Reads the samples of the other workers. Gauges of workers that are gone (e.g. their open WebSockets)
+            are left out, their counters and histograms are not.
+        '''
+        if not self.dir:
+            return self.others
+
+        others = {}
+        for entry in os.scandir(self.dir):
+            if not entry.name.startswith('metrics-') or not entry.name.endswith('.json'):
+                continue
+
+            pid = int(entry.name.removeprefix('metrics-').removesuffix('.json'))
+            if pid == os.getpid():
+                continue
+
+            try:
+                with open(entry.path) as file:
+                    samples = json.load(file)
+            except (OSError, ValueError):
+                # Removed, or not written by a worker.
+                continue
+
+            alive = is_alive(pid)
+            for name, labels, value in samples:
+                # A worker running other code (e.g. during a deploy) may have metrics this one doesn't know.
+                family = self.families.get(family_of(name))
+                if not family:
+                    continue
+
+                key = (name, tuple(tuple(label) for label in labels))
+                if alive or family.kind != 'gauge':
+                    others[key] = others.get(key, 0) + value
+
+        self.others = others
+        return others
+
+
+    def collect(self) -> dict:
+        '''
+            The samples of every worker, up to date.
+        '''
+        totals = self.samples()
+
+        if self.dir:
+            self.flush()
+
+        for key, value in self.other_samples().items():
+            totals[key] = totals.get(key, 0) + value
+
+        return totals
+
+
+    def total(self, name: str, **labels) -> float:
+        '''
+            Value of one sample across the workers. The part of the other workers is the one read by the last
+            collect (when the metrics were scraped), so no file is read here.
+        '''
+        key = (name, label_key(labels))
+        return sum(values.get(key, 0) for values in list(self.shards)) + self.others.get(key, 0)
+
+
+registry = Registry(**getattr(settings, 'METRICS', {}))
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def family_of(name: str) -> str:
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name.removesuffix(suffix) in registry.families:
+            return name.removesuffix(suffix)
+
+    return name
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        registry.families[name] = self
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value: float = 1, **labels):
+        registry.add(self.name, label_key(labels), value)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def samples(self, value: float, **labels) -> dict:
+        labels = label_key(labels)
+        samples = {(f'{self.name}_bucket', labels + (('le', str(bound)),)): int(value <= bound) for bound in self.buckets}
+        samples[(f'{self.name}_bucket', labels + (('le', '+Inf'),))] = 1
+        samples[(f'{self.name}_sum', labels)] = value
+        samples[(f'{self.name}_count', labels)] = 1
+        return samples
+
+
+    def observe(self, value: float, **labels):
+        for (name, sample_labels), amount in self.samples(value, **labels).items():
+            registry.add(name, sample_labels, amount)
+
+
+hands_started = Counter('bleff_hands_started_total', 'Hands created.')
+hands_finished = Counter('bleff_hands_finished_total', 'Hands ended.')
+vote_to_hand_end = Histogram('bleff_vote_to_hand_end_seconds', 'From the last vote of a hand until the hand (and its game) ended.')
+websockets_open = Gauge('bleff_websockets_open', 'WebSockets open in GameConsumer, by game.')
+broadcast_fanout = Histogram('bleff_broadcast_fanout', 'WebSockets open in the game of each event sent by ws_event.', buckets=SIZE_BUCKETS)
+view_latency = Histogram('bleff_view_latency_seconds', 'Time of each request, by view.')
+# Read from the process-local caches (see game.cache.LRUCache) when the samples are flushed or collected.
+cache_hits = Counter('bleff_cache_hits_total', 'Lookups found in a process-local cache, by cache.')
+cache_misses = Counter('bleff_cache_misses_total', 'Lookups not found in a process-local cache, by cache.')
+cache_entries = Gauge('bleff_cache_entries', 'Entries of a process-local cache, by cache.')
+cache_bytes = Gauge('bleff_cache_bytes', 'Approximate size (length of their JSON) of the entries of a process-local cache, by cache.')
+# Read from the database when the metrics are collected, they are not added up.
+active_games = Gauge('bleff_active_games', 'Games not finished.')
+players_per_game = Histogram('bleff_players_per_game', 'Players of the games not finished.', buckets=SIZE_BUCKETS)
+
+
+def cache_samples() -> dict:
+    samples = {}
+
+    for name, lru in [('finished_hands', finished_hands), ('meanings', meanings)]:
+        stats = lru.stats()
+        labels = label_key({'cache': name})
+        samples[(cache_hits.name, labels)] = stats['hits']
+        samples[(cache_misses.name, labels)] = stats['misses']
+        samples[(cache_entries.name, labels)] = stats['entries']
+        samples[(cache_bytes.name, labels)] = stats['bytes']
+
+    return samples
+
+
+registry.collectors.append(cache_samples)
+
+
+def database_samples() -> dict:
+    samples = {(active_games.name, ()): Game.objects.filter(finished_at__isnull=True).count()}
+
+    players = Play.objects.filter(game__finished_at__isnull=True).values('game').annotate(n=Count('id')).values_list('n', flat=True)
+    for n in players:
+        for key, value in players_per_game.samples(n).items():
+            samples[key] = samples.get(key, 0) + value
+
+    return samples
+
+
+def render(samples: dict) -> str:
+    '''
+        The samples in the Prometheus text format. Gauges at 0 (e.g. games without WebSockets) are left out.
+    '''
+    families = {}
+    for (name, labels), value in samples.items():
+        family = registry.families[family_of(name)]
+        if family.kind == 'gauge' and not value and labels:
+            continue
+        families.setdefault(family.name, []).append((name, labels, value))
+
+    lines = []
+    for name in sorted(families):
+        family = registry.families[name]
+        lines.append(f'# HELP {name} {family.help}')
+        lines.append(f'# TYPE {name} {family.kind}')
+
+        for sample, labels, value in sorted(families[name], key=sample_order):
+            text = ','.join(f'{key}="{label}"' for key, label in labels)
+            value = int(value) if float(value).is_integer() else value
+            lines.append(f'{sample}{{{text}}} {value}' if text else f'{sample} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def sample_order(sample: tuple):
+    # Buckets from the smallest to +Inf, then _count and _sum.
+    name, labels, _ = sample
+    bound = dict(labels).get('le')
+    other = tuple(label for label in labels if label[0] != 'le')
+    return (other, name, float(bound or 0))
@@ -0,0 +1,175 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+from .template_backends import render_time
+from .nplusone import detect_n_plus_one
+from .tracing import span
+from .metrics import view_latency
+from .capture import capture_file, references, created_game, IGNORED_VIEWS
+
+logger = logging.getLogger('game.performance')
+
+
+class QueryRecorder:
+    '''
+        Execute wrapper that counts the queries (and how many of them repeat the same SQL and parameters) and their time.
+    '''
+
+    def __init__(self) -> None:
+        self.time = 0.0
+        self.shapes = Counter()
+
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.shapes[(sql, repr(params))] += 1
+
+
+    @property
+    def count(self) -> int:
+        return sum(self.shapes.values())
+
+
+    @property
+    def duplicates(self) -> int:
+        return sum(count - 1 for count in self.shapes.values())
+
+
+class PerformanceMiddleware:
+    '''
+        Measures every request: total time, database time, queries, duplicated queries and template render time.
+        They are sent back in a Server-Timing header (with DEBUG, to staff or with settings.SERVER_TIMING), and
+        a sample of them (settings.PERFORMANCE_LOG_SAMPLE_RATE) is written to the 'game.performance' logger.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        token = render_time.set(0.0)
+        start = time.perf_counter()
+
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(recorder))
+
+                response = self.get_response(request)
+        finally:
+            templates = render_time.get()
+            render_time.reset(token)
+
+        total = time.perf_counter() - start
+        view_latency.observe(total, view=getattr(request.resolver_match, 'view_name', None) or 'unresolved')
+
+        # The queries of a page tell how it is built, they are not for everyone.
+        if settings.DEBUG or getattr(settings, 'SERVER_TIMING', False) or getattr(getattr(request, 'user', None), 'is_staff', False):
+            response['Server-Timing'] = ', '.join([
+                f'total;dur={total * 1000:.2f}',
+                f'db;dur={recorder.time * 1000:.2f};desc="{recorder.count} queries ({recorder.duplicates} duplicated)"',
+                f'tpl;dur={templates * 1000:.2f}',
+            ])
+
+        if random.random() < getattr(settings, 'PERFORMANCE_LOG_SAMPLE_RATE', 0):
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': getattr(request.resolver_match, 'view_name', None),
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 2),
+                'db_ms': round(recorder.time * 1000, 2),
+                'queries': recorder.count,
+                'duplicates': recorder.duplicates,
+                'template_ms': round(templates * 1000, 2),
+            }))
+
+        return response
+
+
+class NPlusOneMiddleware:
+    '''
+        Runs every request under detect_n_plus_one (see settings.N_PLUS_ONE).
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+
+    def __call__(self, request):
+        with detect_n_plus_one(f'{request.method} {request.path}'):
+            return self.get_response(request)
+
+
+class TracingMiddleware:
+    '''
+        Every request is the root span of a trace (see game.tracing), named after its view.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+
+    def __call__(self, request):
+        with span(f'{request.method} {request.path}') as root:
+            response = self.get_response(request)
+
+            if root and request.resolver_match:
+                root.name = f'{request.method} {request.resolver_match.view_name}'
+                root.attributes.update(game_id=request.resolver_match.kwargs.get('game_id'), status=response.status_code)
+
+            return response
+
+
+class CaptureMiddleware:
+    '''
+        Writes every game action (user, view, payload, timing) to settings.CAPTURE['file'], so
+        'python manage.py replay_capture' can run the same traffic again.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        capture = getattr(request, 'capture', None)
+
+        if capture:
+            file, action = capture
+            action['s'] = response.status_code
+
+            if action['v'] == 'game:create':
+                action['c'] = created_game(response.get('Location', ''))
+
+            file.write(action)
+
+        return response
+
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        file = capture_file()
+        match = request.resolver_match
+
+        if not file or match.app_name != 'game' or match.view_name in IGNORED_VIEWS:
+            return None
+
+        data = request.POST.dict()
+        data.pop('csrfmiddlewaretoken', None)
+
+        # References are read before the action changes what they point to.
+        request.capture = (file, {
+            't': time.time(), 'u': request.user.username or None, 'm': request.method, 'v': match.view_name,
+            'k': view_kwargs, 'd': data, 'r': references(match.view_name, view_kwargs, data),
+        })
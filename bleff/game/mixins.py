@@ -0,0 +1,61 @@
+from typing import Any
+from django.db.models.base import DEFERRED
+
+class TrackChangesMixin:
+    '''
+        Keeps a snapshot of the values loaded from (or last saved to) the database, so pre_save and post_save
+        receivers can compare old vs new values without fetching the previus row again.
+        Foreign keys are tracked by their id (e.g. 'word' is compared using 'word_id').
+    '''
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._take_snapshot()
+        return instance
+
+
+    def save(self, *args, **kwargs):
+        # A new row has no previus values.
+        if self._state.adding:
+            self._loaded_values = {}
+
+        super().save(*args, **kwargs)
+        self._take_snapshot()
+
+
+    def _take_snapshot(self):
+        self._loaded_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if self.__dict__.get(field.attname, DEFERRED) is not DEFERRED
+        }
+
+
+    def _snapshot(self) -> dict[str, Any]:
+        # Instances built by hand (not loaded nor saved) need the row once.
+        if not hasattr(self, '_loaded_values'):
+            self._loaded_values = {}
+
+            if self.pk:
+                row = type(self).objects.filter(pk=self.pk).values(*[f.attname for f in self._meta.concrete_fields]).first()
+                self._loaded_values = row or {}
+
+        return self._loaded_values
+
+
+    def previous(self, field: str) -> Any:
+        '''
+            Value of 'field' when it was loaded or last saved. None if the instance was never saved.
+        '''
+        return self._snapshot().get(self._meta.get_field(field).attname)
+
+
+    def has_changed(self, field: str) -> bool:
+        attname = self._meta.get_field(field).attname
+        snapshot = self._snapshot()
+
+        if not attname in snapshot:
+            return self.pk is None or getattr(self, attname) is not None
+
+        return snapshot[attname] != getattr(self, attname)
@@ -1,11 +1,16 @@
+import json
+import zlib
 from django.core.validators import MinLengthValidator
 from django.utils import timezone
 from django.forms import ValidationError
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.db.models import F
-from django.db import models
+from django.db import models, transaction, router
 
 from .validators import FieldNull
+from .mixins import TrackChangesMixin
+from .tracing import traced
 
 class Word(models.Model):
     word = models.CharField(max_length=40, unique=True, validators=[MinLengthValidator(3)])
@@ -38,26 +43,142 @@ class Meaning(models.Model):
         return f'{self.word_translation}: {self.text}'
 
 
-class Game(models.Model):
+class GameSequence(models.Model):
+    '''
+        Hands out game ids when games are sharded (see routers.GameShardRouter), so ids are unique across shards.
+    '''
+    created_at = models.DateTimeField(default=timezone.now)
+
+
+class Game(TrackChangesMixin, models.Model):
     # TODO: a function to determinate who wins (winner). 
     created_at = models.DateTimeField(default=timezone.now)
     idiom = models.ForeignKey(Language, on_delete=models.PROTECT)
     creator = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     finished_at = models.DateTimeField(default=None, blank=True, null=True)
+    # Users ids in the order they joined, and how many seats (counted from the last one) the next leader is.
+    seating = models.JSONField(default=list, blank=True)
+    rotation_index = models.PositiveIntegerField(default=0)
+    # Ids of the words already chosen in this game's hands.
+    played_words = models.JSONField(default=list, blank=True)
+
+    # Only written with targeted UPDATEs (see 'add_played_word' and '_update_rotation').
+    MANAGED_FIELDS = ['seating', 'rotation_index', 'played_words']
 
     def __str__(self):
         return f'Game {self.id}: created by {self.creator.username if self.creator else "SECRET"}'
+
+
+    def save(self, *args, **kwargs):
+        # With shards, the id decides where the game lives, so it must be known before inserting.
+        if not self.pk and settings.GAME_SHARDS:
+            self.id = GameSequence.objects.using('default').create().id
+
+        # A regular save (e.g. from the admin) must not overwrite them with stale values.
+        if self.pk and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and not f.name in self.MANAGED_FIELDS]
+
+        super().save(*args, **kwargs)
     
 
+    @traced('game.end')
     def end(self):
-        if self.finished_at:
-            raise ValidationError("Can't end a game more than one time")
-        self.finished_at = timezone.now()
-        self.save()
+        db = self._db()
+        finished_at = timezone.now()
+
+        with transaction.atomic(using=db):
+            # Claimed with one UPDATE, so when two requests end the game at once only one of them does.
+            if self.finished_at or not Game.objects.using(db).filter(pk=self.pk, finished_at__isnull=True).update(finished_at=finished_at):
+                raise ValidationError("Can't end a game more than one time")
+
+            self.finished_at = finished_at
+            self.save(update_fields=['finished_at'])
 
 
     def words_played(self):
-        return [hand.word for hand in Hand.objects.filter(game=self).exclude(word=None)]
+        return list(Word.objects.filter(id__in=self.played_word_ids()))
+
+
+    def played_word_ids(self) -> set[int]:
+        return set(Game.objects.using(self._db()).values_list('played_words', flat=True).get(pk=self.pk))
+
+
+    def add_played_word(self, word_id: int):
+        db = self._db()
+
+        with transaction.atomic(using=db):
+            played_words = Game.objects.using(db).select_for_update().values_list('played_words', flat=True).get(pk=self.pk)
+
+            if not word_id in played_words:
+                played_words.append(word_id)
+                Game.objects.using(db).filter(pk=self.pk).update(played_words=played_words)
+                self.played_words = played_words
+                self._snapshot()['played_words'] = list(played_words)
+
+
+    def take_seat(self, user_id: int):
+        '''
+            Adds user_id as the last seat. The newest player always leads the next hand.
+        '''
+        db = self._db()
+
+        with transaction.atomic(using=db):
+            seating, _ = Game.objects.using(db).select_for_update().values_list('seating', 'rotation_index').get(pk=self.pk)
+
+            if not user_id in seating:
+                seating.append(user_id)
+                self._update_rotation(seating, 0)
+
+
+    def leave_seat(self, user_id: int):
+        '''
+            Removes user_id from the seating, keeping the pointer on the same next leader (or the following one if user_id was next).
+        '''
+        db = self._db()
+
+        with transaction.atomic(using=db):
+            seating, rotation_index = Game.objects.using(db).select_for_update().values_list('seating', 'rotation_index').get(pk=self.pk)
+
+            if user_id in seating:
+                seat = seating.index(user_id)
+                rotation_index %= len(seating)
+                next_seat = len(seating) - 1 - rotation_index
+                seating.remove(user_id)
+                self._update_rotation(seating, rotation_index - 1 if seat > next_seat else rotation_index)
+
+
+    def next_leader_id(self) -> int | None:
+        '''
+            Returns the id of the user that should lead the next hand, without moving the pointer.
+            Leaders go from the last seat to the first one.
+        '''
+        seating, rotation_index = Game.objects.using(self._db()).values_list('seating', 'rotation_index').get(pk=self.pk)
+        return seating[len(seating) - 1 - rotation_index % len(seating)] if seating else None
+
+
+    def rotate_after(self, user_id: int):
+        '''
+            Moves the pointer to the seat before user_id.
+        '''
+        db = self._db()
+
+        with transaction.atomic(using=db):
+            seating, _ = Game.objects.using(db).select_for_update().values_list('seating', 'rotation_index').get(pk=self.pk)
+
+            if user_id in seating:
+                self._update_rotation(seating, (len(seating) - seating.index(user_id)) % len(seating))
+
+
+    def _db(self) -> str:
+        return router.db_for_write(Game, instance=self)
+
+
+    def _update_rotation(self, seating: list[int], rotation_index: int):
+        rotation_index = max(rotation_index, 0)
+        Game.objects.using(self._db()).filter(pk=self.pk).update(seating=seating, rotation_index=rotation_index)
+        self.seating = seating
+        self.rotation_index = rotation_index
+        self._snapshot().update({'seating': list(seating), 'rotation_index': rotation_index})
 
 
 class Play(models.Model):
@@ -75,13 +196,21 @@ class Play(models.Model):
         return f'User {self.user.username} plays/ed Game nro°{self.game.id}'
     
 
-class Hand(models.Model):
+class Hand(TrackChangesMixin, models.Model):
     # TODO: a function to determinate who is the hand winner (winner)
     created_at = models.DateTimeField(default=timezone.now)
     finished_at = models.DateTimeField(null=True, blank=True, default=None)
     leader = models.ForeignKey(User, on_delete=models.SET_NULL, default=None, null=True, blank=True)
     game = models.ForeignKey(Game, on_delete=models.CASCADE, validators=[FieldNull(model=Game, field='finished_at')])
     word = models.ForeignKey(Word, on_delete=models.PROTECT, null=True, blank=True)
+    # Progress counters. They are only written with F() expressions (see 'update_progress').
+    players_expected = models.PositiveIntegerField(default=0)
+    guesses_submitted = models.PositiveIntegerField(default=0)
+    pending_checks = models.PositiveIntegerField(default=0)
+    votes_cast = models.PositiveIntegerField(default=0)
+    correct_guessers = models.PositiveIntegerField(default=0)
+
+    PROGRESS_FIELDS = ['players_expected', 'guesses_submitted', 'pending_checks', 'votes_cast', 'correct_guessers']
 
 
     class Meta:
@@ -91,24 +220,60 @@ class Hand(models.Model):
 
 
     def save(self, *args, **kwargs):
-        if self.leader and not Play.objects.filter(game=self.game, user=self.leader).exists():
-            raise ValidationError("Leader can't be an User that does not belong")
-        elif self.finished_at and self.finished_at < self.created_at:
-            raise ValidationError('A Hand can not be finished before it starts')
+        # The lifecycle uses the models.
+        from .lifecycle import HandLifecycle
 
-        super().save(*args, **kwargs)
+        # A regular save must not overwrite the counters with stale values.
+        if self.pk and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and not f.name in self.PROGRESS_FIELDS]
+
+        # The hand, its choices, the seating and the original guess are written together (see lifecycle.HandLifecycle).
+        lifecycle = HandLifecycle(self)
+        with lifecycle.atomic():
+            lifecycle.before_save()
+            super().save(*args, **kwargs)
+            lifecycle.after_save()
 
 
     def __str__(self):
         return f'Hand {self.id}'
     
     
+    @traced('hand.end')
     def end(self):
-        if self.finished_at:
-            raise ValidationError("Can't end a hand more than one time")
+        db = router.db_for_write(Hand, instance=self)
+        finished_at = timezone.now()
+
+        with transaction.atomic(using=db):
+            # Claimed with one UPDATE, so when the last two votes end the hand at once only one of them does.
+            if self.finished_at or not Hand.objects.using(db).filter(pk=self.pk, finished_at__isnull=True).update(finished_at=finished_at):
+                raise ValidationError("Can't end a hand more than one time")
+
+            self.finished_at = finished_at
+            self.save()
+
+
+    @staticmethod
+    def update_progress(hand_id: int, **deltas: int):
+        '''
+            Adds deltas to the progress counters atomically, e.g. update_progress(hand.id, votes_cast=1).
+        '''
+        changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
 
-        self.finished_at = timezone.now()
-        self.save()
+        if changes:
+            Hand.objects.filter(pk=hand_id).update(**changes)
+
+
+    @property
+    def votes_remaining(self) -> int:
+        return self.players_expected - 1 - self.correct_guessers - self.votes_cast
+
+
+    def progress(self) -> dict:
+        return {
+            **{field: getattr(self, field) for field in self.PROGRESS_FIELDS},
+            'votes_remaining': self.votes_remaining,
+        }
 
 
 class Guess(models.Model):
@@ -141,7 +306,7 @@ class Guess(models.Model):
         return f'Guess by {self.writer.username if self.writer else "GAME"}'
     
 
-class HandGuess(models.Model):
+class HandGuess(TrackChangesMixin, models.Model):
     hand = models.ForeignKey(Hand, on_delete=models.CASCADE)
     guess = models.ForeignKey(Guess, on_delete=models.CASCADE)
     is_correct = models.BooleanField(default=None, blank=None, null=True)
@@ -180,7 +345,7 @@ class Choice(models.Model):
 
 
     def save(self, *args, **kwargs):
-        if self.word in self.hand.game.words_played():
+        if self.word_id in self.hand.game.played_word_ids():
             raise ValidationError('Word already played in this game')
         elif self.word and self.hand and not Meaning.objects.filter(word=self.word, language=self.hand.game.idiom):
             raise ValidationError("Word must have a Meaning in Game idiom")
@@ -220,3 +385,26 @@ class Condition(models.Model):
             raise ValidationError(f"Value should be an integer between {self.tag.min} and {self.tag.max}. Value received: {self.value}")
 
         super().save(*args, **kwargs)
+
+
+class GameArchive(models.Model):
+    '''
+        A finished game serialised in one compressed row (see archive.py). Its hands, guesses, votes and choices are removed from the hot tables.
+    '''
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, primary_key=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    data = models.BinaryField()
+
+
+    def __str__(self):
+        return f'Archive of Game {self.game_id}'
+
+
+    def load(self) -> dict:
+        return json.loads(zlib.decompress(self.data))
+
+
+class ArchivedHand(models.Model):
+    # Same id the Hand had, so old links keep working.
+    id = models.BigIntegerField(primary_key=True)
+    archive = models.ForeignKey(GameArchive, on_delete=models.CASCADE)
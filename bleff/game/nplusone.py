@@ -0,0 +1,104 @@
+import logging
+import os
+import re
+import traceback
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('game.nplusone')
+
+NUMBER = re.compile(r'\b\d+(\.\d+)?\b')
+STRING = re.compile(r"'(?:[^']|'')*'")
+PLACEHOLDERS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+ROWS = re.compile(r'(\(\?\))(?:\s*,\s*\(\?\))+')
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def fingerprint(sql: str) -> str:
+    '''
+        The shape of a query: the same query with other values (or more of them in an IN) has the same shape.
+    '''
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    sql = PLACEHOLDERS.sub('(?)', sql.replace('%s', '?'))
+    return ROWS.sub(r'\1', sql)
+
+
+def origin(stack: traceback.StackSummary) -> str | None:
+    '''
+        The innermost frame of the project's code that ran the query. The frames from Django's database backends
+        on are the execute wrappers (this one included), they don't tell who asked for it.
+    '''
+    base = str(settings.BASE_DIR)
+    backends = os.path.join('django', 'db', 'backends', '')
+    found = None
+
+    for frame in stack:
+        if backends in frame.filename:
+            break
+        elif frame.filename.startswith(base) and 'site-packages' not in frame.filename:
+            found = f'{os.path.relpath(frame.filename, base)}:{frame.lineno} in {frame.name}'
+
+    return found
+
+
+class NPlusOneDetector:
+    '''
+        Execute wrapper that counts the queries of each shape. The shapes executed more than threshold times
+        are the suspects, with the frame that ran them when the threshold was crossed.
+    '''
+
+    def __init__(self, threshold: int) -> None:
+        self.threshold = threshold
+        self.counts = {}
+        self.origins = {}
+
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = fingerprint(sql)
+        self.counts[shape] = self.counts.get(shape, 0) + 1
+
+        # The stack is only walked once per suspect, when it crosses the threshold.
+        if self.counts[shape] == self.threshold + 1:
+            self.origins[shape] = origin(traceback.extract_stack())
+
+        return execute(sql, params, many, context)
+
+
+    def suspects(self) -> list[dict]:
+        return [
+            {'sql': shape, 'count': self.counts[shape], 'origin': where}
+            for shape, where in self.origins.items()
+        ]
+
+
+@contextmanager
+def detect_n_plus_one(name: str):
+    '''
+        Detects N+1 queries while the block runs (a request, a consumer message...). They are logged to the
+        'game.nplusone' logger, and in strict mode they raise NPlusOneError.
+    '''
+    config = getattr(settings, 'N_PLUS_ONE', {})
+
+    if not config.get('enabled'):
+        yield
+        return
+
+    detector = NPlusOneDetector(threshold=config.get('threshold', 5))
+
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(detector))
+
+        yield detector
+
+    suspects = detector.suspects()
+    for suspect in suspects:
+        logger.warning('%s: %s queries like "%s" from %s', name, suspect['count'], suspect['sql'], suspect['origin'])
+
+    if suspects and config.get('strict'):
+        raise NPlusOneError(f'{name}: ' + '; '.join(f"{s['count']} x {s['sql']} ({s['origin']})" for s in suspects))
@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+REPLICA = 'replica'
+
+# Models that belong to a single game and live in that game's shard.
+GAME_MODELS = {'game', 'play', 'hand', 'guess', 'handguess', 'vote', 'choice', 'condition', 'gamearchive', 'archivedhand'}
+
+# Rows every database needs, copied from 'default' by replicate(). Order matters: rows are copied after the rows
+# they point to. Labels, as this module is loaded with the settings, before the models.
+REFERENCE_MODELS = ['auth.User', 'game.Language', 'game.Word', 'game.Meaning', 'game.ConditionTag']
+
+_use_replica = ContextVar('use_replica', default=False)
+_game_shard = ContextVar('game_shard', default=None)
+
+
+def replica_configured() -> bool:
+    return REPLICA in settings.DATABASES
+
+
+def reading_replica() -> bool:
+    '''
+        True inside a use_replica block when there is a replica to read from.
+    '''
+    return _use_replica.get() and replica_configured()
+
+
+@contextmanager
+def use_replica(enabled: bool = True):
+    '''
+        Reads made inside this block go to the replica (if there is one configured).
+    '''
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def shard_for_game(game_id: int) -> str:
+    '''
+        Database alias of the shard that keeps game_id (or 'default' if games are not sharded).
+    '''
+    shards = settings.GAME_SHARDS
+    return shards[int(game_id) % len(shards)] if shards else 'default'
+
+
+@contextmanager
+def use_shard(game_id: int):
+    '''
+        Queries on game models made inside this block go to game_id's shard.
+    '''
+    token = _game_shard.set(shard_for_game(game_id))
+    try:
+        yield
+    finally:
+        _game_shard.reset(token)
+
+
+def replicate(alias: str, batch_size: int = 1000, source: str = 'default') -> int:
+    '''
+        Copies (inserting or updating) every reference row from source to alias. Returns the number of rows copied.
+    '''
+    copied = 0
+
+    for model in map(apps.get_model, REFERENCE_MODELS):
+        pk = model._meta.pk
+        fields = [f.name for f in model._meta.concrete_fields if not f.primary_key]
+        rows = model.objects.using(source).order_by(pk.name)
+
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(row)
+
+            if len(batch) == batch_size:
+                model.objects.using(alias).bulk_create(batch, update_conflicts=True, unique_fields=[pk.name], update_fields=fields)
+                copied += len(batch)
+                batch = []
+
+        if batch:
+            model.objects.using(alias).bulk_create(batch, update_conflicts=True, unique_fields=[pk.name], update_fields=fields)
+            copied += len(batch)
+
+    return copied
+
+
+class GameShardRouter:
+    '''
+        Places every game model on the shard chosen by its game id. Reference data (words, meanings, languages,
+        condition tags and users) is written to 'default' and copied to the shards with 'replicate_reference_data'.
+        It does nothing while settings.GAME_SHARDS is empty.
+
+        Only 'benchmark_shards' plays games on shards: views, consumers and signals don't choose one with use_shard,
+        so a game query that isn't inside use_shard (nor made from an instance) raises ImproperlyConfigured instead
+        of reading or writing the wrong database.
+    '''
+
+    def _shard(self, model, instance=None):
+        if not settings.GAME_SHARDS or model._meta.app_label != 'game' or not model._meta.model_name in GAME_MODELS:
+            return None
+
+        if _game_shard.get():
+            return _game_shard.get()
+        elif instance is not None and not instance._state.adding and instance._state.db:
+            return instance._state.db
+        elif instance is not None and getattr(instance, 'game_id', None):
+            return shard_for_game(instance.game_id)
+        elif instance is not None and model._meta.model_name == 'game' and instance.pk:
+            return shard_for_game(instance.pk)
+
+        elif instance is None:
+            raise ImproperlyConfigured(f'{model.__name__} queried outside use_shard() while GAME_SHARDS is set, games are only sharded in benchmark_shards.')
+
+        return instance._state.db
+
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints.get('instance'))
+
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints.get('instance'))
+
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True if settings.GAME_SHARDS else None
+
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards need every table, reference ones included, so foreign keys hold.
+        return None
+
+
+class ReplicaRouter:
+    '''
+        Sends reads to the replica only when a view opted in (see decorators.replica_reads). Writes always go to default.
+    '''
+
+    def db_for_read(self, model, **hints):
+        return REPLICA if reading_replica() else None
+
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
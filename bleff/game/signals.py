@@ -1,11 +1,14 @@
-import random
-from django.db.models.signals import post_save, pre_save
-from django.dispatch import receiver
+from django.db.models.signals import post_save, pre_save, post_delete
+from django.db.backends.signals import connection_created
 from django.forms import ValidationError
 from django.conf import settings
+from django.db.models import F
+from django.db import transaction, router
 
-from .models import Game, Play, Hand, Guess, Meaning, HandGuess, Vote, Choice, Word
-from .utils import plays_game, is_leader
+from .models import Game, Play, Hand, Guess, Meaning, HandGuess, Vote, Choice, Word, Condition, Language
+from .utils import vote_rejection, game_id_of
+from .cache import finished_hands, bump_game_version, meanings
+from .instrumentation import receiver
 
 @receiver(post_save, sender=Game)
 def play_creation_creator(sender, instance, created, **kwargs):
@@ -13,12 +16,6 @@ def play_creation_creator(sender, instance, created, **kwargs):
         Play.objects.create(game=instance, user=instance.creator)
 
 
-@receiver(post_save, sender=Hand)
-def right_guess_creator(sender, instance, created, **kwargs):
-    if instance.word and not Guess.objects.filter(hand=instance, is_original=True).exists():
-        Guess.objects.create(content=Meaning.objects.filter(word=instance.word)[0].text, is_original=True, hand=instance)
-
-
 @receiver(post_save, sender=Guess)
 def handguess_creator(sender, instance, created, **kwargs):
     if created:
@@ -29,92 +26,151 @@ def handguess_creator(sender, instance, created, **kwargs):
 @receiver(pre_save, sender=HandGuess)
 def handguess_update_restriction(sender, instance, **kwargs):
     if instance.pk:
-            previus = HandGuess.objects.get(pk=instance.pk)
-        
             '''
             This means that was modified to True before.
             TODO: Should check if there are any votes, in that case updating is forbidden.
             '''
-            if previus.is_correct:
+            if instance.previous('is_correct'):
                 raise ValidationError("You can update HandGuess just one time")
-            elif not previus.guess.writer:
+            elif not instance.guess.writer_id:
                 raise ValidationError("You can't modify 'by default Guess' HandGuess")
             
 
+@receiver(post_save, sender=HandGuess)
+def hand_progress_handguess(sender, instance, created, **kwargs):
+    if created:
+        Hand.update_progress(
+            instance.hand_id,
+            guesses_submitted=1 if instance.guess.writer_id else 0,
+            pending_checks=1 if instance.is_correct is None else 0,
+            correct_guessers=1 if instance.is_correct else 0,
+        )
+    elif instance.has_changed('is_correct'):
+        previous = instance.previous('is_correct')
+        Hand.update_progress(
+            instance.hand_id,
+            pending_checks=(instance.is_correct is None) - (previous is None),
+            correct_guessers=bool(instance.is_correct) - bool(previous),
+        )
+
+
+@receiver(post_delete, sender=HandGuess)
+def hand_progress_handguess_deleted(sender, instance, **kwargs):
+    Hand.update_progress(
+        instance.hand_id,
+        guesses_submitted=-1 if Guess.objects.filter(pk=instance.guess_id, writer__isnull=False).exists() else 0,
+        pending_checks=-1 if instance.is_correct is None else 0,
+        correct_guessers=-1 if instance.is_correct else 0,
+    )
+
+
 @receiver(pre_save, sender=Vote)
 def vote_creator_restriction(sender, instance, **kwargs):
     if not instance.pk:
-        if not plays_game(user=instance.user, game_id=instance.to.hand.game):
-            raise ValidationError("You can't vote in a game you are not playing")
-        elif is_leader(user=instance.user, game_id=instance.to.hand.game):
-            raise ValidationError("You can't vote if you are the leader")
-        elif instance.to.hand.finished_at:
-            raise ValidationError("You can't vote in a finished hand")
-        elif Vote.objects.filter(to__hand=instance.to.hand, user=instance.user).exists():
-            raise ValidationError("You can't vote again in the same hand")
-        elif HandGuess.objects.filter(hand=instance.to.hand, is_correct=True, guess__writer=instance.user):
-            raise ValidationError("You can't vote if you guessed right")
+        rejection = vote_rejection(user=instance.user, hand_guess_id=instance.to_id)
+
+        if rejection:
+            raise ValidationError(rejection.value)
         
 
-@receiver(pre_save, sender=Hand)
-def hand_set_leader(sender, instance, **kwargs):
-    if not instance.leader:
-        # Gets game players.
-        players = [p.user for p in Play.objects.filter(game=instance.game)]
+@receiver(post_save, sender=Vote)
+def hand_progress_vote(sender, instance, created, **kwargs):
+    if created and instance.to.is_correct == False:
+        Hand.update_progress(instance.to.hand_id, votes_cast=1)
+
 
-        # Gets te last n (number of players - 1) leaders.
-        last_n_leaders = [h.leader for h in Hand.objects.filter(game=instance.game).order_by('-created_at')][:len(players)-1]
+@receiver(post_delete, sender=Vote)
+def hand_progress_vote_deleted(sender, instance, **kwargs):
+    hand_id = HandGuess.objects.filter(pk=instance.to_id, is_correct=False).values_list('hand_id', flat=True).first()
 
-        # If any of them does not apper in last_n_leaders, we got the leader.
-        for p in players:
-            if not p in last_n_leaders:
-                instance.leader = p
+    if hand_id:
+        Hand.update_progress(hand_id, votes_cast=-1)
 
 
-@receiver(post_save, sender=Hand)
-def hand_create_default_choice(sender, instance: Hand, created, **kwargs):
+@receiver(pre_save, sender=Game)
+def user_already_playing_for_game_creation(sender, instance, **kwargs):
+    if not instance.pk and instance.creator:
+        if Play.objects.filter(user=instance.creator).exclude(game__finished_at__isnull=False).exists():
+            raise ValidationError('User is already playing something')
+        
+
+@receiver(post_save, sender=Play)
+def play_take_seat(sender, instance, created, **kwargs):
     if created:
-        word_counter = 0
-        words_played_ids = [w.id for w in instance.game.words_played()]
-        possible_words = list(Word.objects.exclude(id__in=words_played_ids))
-        n_words = len(possible_words)
+        instance.game.take_seat(user_id=instance.user_id)
+        Hand.objects.filter(game=instance.game_id, finished_at=None).update(players_expected=F('players_expected') + 1)
 
-        while word_counter < settings.CHOICES_PER_HAND and word_counter < n_words:
-            random_word = random.choice(possible_words)
-            Choice.objects.create(hand=instance, word=random_word)
-            possible_words.remove(random_word)
-            word_counter += 1
 
+@receiver(post_delete, sender=Play)
+def play_leave_seat(sender, instance, **kwargs):
+    if Game.objects.filter(pk=instance.game_id).exists():
+        instance.game.leave_seat(user_id=instance.user_id)
+        Hand.objects.filter(game=instance.game_id, finished_at=None, players_expected__gt=0).update(players_expected=F('players_expected') - 1)
 
-@receiver(pre_save, sender=Hand)
-def hand_word_change(sender, instance, **kwargs):
-    if instance.id:
-        previus = Hand.objects.get(id=instance.id)
 
-        if previus.word != instance.word and not Choice.objects.filter(hand=instance, word=instance.word):
-            raise ValidationError('Should exists a choice for this word to set it')
-        elif previus.word != None and previus.word != instance.word:
-            raise ValidationError('Hand word can not be changed')
+@receiver(pre_save, sender=Game)
+def game_finished_restriction(sender, instance, **kwargs):
+    if instance.pk and instance.previous('finished_at') and instance.has_changed('finished_at'):
+        raise ValidationError("A finished game can not be modified")
 
 
-@receiver(pre_save, sender=Hand)
-def hand_creation_restriction(sender, instance, **kwargs):
-    game = instance.game if hasattr(instance, 'game') else None
-    unfinished_hand = Hand.objects.filter(game=game, finished_at=None).exclude(id=instance.id).exists()
+@receiver([post_save, post_delete], sender=Hand)
+@receiver([post_save, post_delete], sender=Guess)
+@receiver([post_save, post_delete], sender=HandGuess)
+def finished_hand_cache_eviction(sender, instance, **kwargs):
+    finished_hands.delete(instance.id if sender == Hand else instance.hand_id)
 
-    if unfinished_hand and instance.id == None:
-        raise ValidationError('The previus hand must finish before another its created!')
 
+@receiver([post_save, post_delete], sender=Vote)
+def finished_hand_cache_eviction_vote(sender, instance, **kwargs):
+    # Avoids a query when the HandGuess is already loaded, this runs for every vote.
+    if Vote.to.is_cached(instance):
+        finished_hands.delete(instance.to.hand_id)
+    else:
+        finished_hands.delete(HandGuess.objects.filter(pk=instance.to_id).values_list('hand_id', flat=True).first())
+
+
+@receiver([post_save, post_delete], sender=Game)
+@receiver([post_save, post_delete], sender=Play)
+@receiver([post_save, post_delete], sender=Hand)
+@receiver([post_save, post_delete], sender=Guess)
+@receiver([post_save, post_delete], sender=HandGuess)
+@receiver([post_save, post_delete], sender=Vote)
+@receiver([post_save, post_delete], sender=Choice)
+@receiver([post_save, post_delete], sender=Condition)
+def game_cache_invalidation(sender, instance, **kwargs):
+    game_id = game_id_of(instance)
+
+    if game_id:
+        # Bumped now for this transaction, and again on commit, so other connections can't cache what they
+        # read before the change was committed.
+        bump_game_version(game_id)
+        transaction.on_commit(lambda: bump_game_version(game_id), using=router.db_for_write(sender, instance=instance))
+
+
+@receiver([post_save, post_delete], sender=Meaning)
+def meaning_cache_eviction(sender, instance, **kwargs):
+    meanings.delete((instance.word_id, instance.language_id))
+
+
+@receiver(post_save, sender=Word)
+def meaning_cache_eviction_word(sender, instance, created, **kwargs):
+    # Cached meanings keep their word, it may be in any language.
+    if not created:
+        for tag in Language.objects.values_list('tag', flat=True):
+            meanings.delete((instance.id, tag))
 
-@receiver(pre_save, sender=Game)
-def user_already_playing_for_game_creation(sender, instance, **kwargs):
-    if not instance.pk and instance.creator:
-        if Play.objects.filter(user=instance.creator).exclude(game__finished_at__isnull=False).exists():
-            raise ValidationError('User is already playing something')
-        
 
 @receiver(pre_save, sender=Play)
 def user_already_playing_for_play_creation(sender, instance, **kwargs):
     if not instance.pk and instance.user:
         if Play.objects.filter(user=instance.user).exclude(game__finished_at__isnull=False).exists():
             raise ValidationError('User is already playing something')
+
+
+@receiver(connection_created)
+def sqlite_connection_setup(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+                cursor.execute(f'PRAGMA {pragma} = {value}')
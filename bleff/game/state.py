@@ -0,0 +1,76 @@
+from django.contrib.auth.models import User
+
+from .models import Game, Hand, Guess, HandGuess, Vote, Choice
+from .cache import cached_for_game
+from .utils import game_points, get_meanings, get_meaning
+
+
+def hand_phase(hand: Hand | None) -> str:
+    '''
+        What the players of hand are doing: 'choosing' the word, 'guessing', 'checking' the guesses or 'voting'.
+    '''
+    if not hand:
+        return 'waiting'
+    elif not hand.word_id:
+        return 'choosing'
+    elif hand.guesses_submitted < hand.players_expected:
+        return 'guessing'
+    elif hand.pending_checks:
+        return 'checking'
+
+    return 'voting'
+
+
+def game_state(game_id: int, user: User) -> dict:
+    '''
+        Everything a player needs to draw the game, as plain data. It is cached in the game's namespace,
+        so it is built again only after the game changes.
+    '''
+    return cached_for_game(game_id, f'state:{user.id}', lambda: _game_state(game_id=game_id, user=user))
+
+
+def _game_state(game_id: int, user: User) -> dict:
+    game = Game.objects.select_related('idiom').get(id=game_id)
+    # One read of the latest hand gives both the phase and last_hand_id, so they always agree.
+    latest = Hand.objects.filter(game=game).select_related('leader', 'word').order_by('-created_at', '-id').first()
+    hand = latest if latest and not latest.finished_at else None
+    phase = 'finished' if game.finished_at else hand_phase(hand)
+    is_leader = bool(hand) and hand.leader_id == user.id
+
+    state = {
+        'game': {'id': game.id, 'creator_id': game.creator_id, 'finished': bool(game.finished_at)},
+        'phase': phase,
+        'hand': None,
+        'scores': [{'user': points['user'].username, 'points': points['value']} for points in game_points(game_id=game.id)],
+        'you': {'id': user.id, 'is_leader': is_leader, 'guessed': False, 'voted': False, 'choices': []},
+    }
+
+    if not hand:
+        state['last_hand_id'] = latest.id if latest else None
+        state['last_finished_hand_id'] = latest.id if latest and latest.finished_at else None
+        return state
+
+    meaning = get_meaning(hand.word_id, game.idiom_id) if hand.word_id else None
+    word = meaning.word_translation if meaning else None
+
+    state['hand'] = {
+        'id': hand.id,
+        'leader': {'id': hand.leader_id, 'username': hand.leader.username if hand.leader else None},
+        'word': word,
+        'progress': hand.progress(),
+        # Guesses are only shown once every one of them was checked, without their writers.
+        'guesses': [
+            {'id': guess_id, 'content': content}
+            for guess_id, content in HandGuess.objects.filter(hand=hand, is_correct=False).order_by('guess__content').values_list('guess_id', 'guess__content')
+        ] if phase == 'voting' else [],
+    }
+
+    if is_leader and phase == 'choosing':
+        word_ids = list(Choice.objects.filter(hand=hand).values_list('word_id', flat=True))
+        meanings = get_meanings(word_ids, game.idiom_id)
+        state['you']['choices'] = [{'word': meanings[i].word, 'translation': meanings[i].word_translation} for i in word_ids if i in meanings]
+
+    state['you']['guessed'] = Guess.objects.filter(hand=hand, writer=user).exists()
+    state['you']['voted'] = Vote.objects.filter(to__hand=hand, user=user).exists()
+
+    return state
@@ -0,0 +1,35 @@
+import time
+from contextvars import ContextVar
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+# Seconds spent rendering templates in the current request, None when nobody is measuring (see middleware).
+render_time = ContextVar('render_time', default=None)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            elapsed = render_time.get()
+            if elapsed is not None:
+                render_time.set(elapsed + time.perf_counter() - start)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    '''
+        Django templates that add their render time to 'render_time'. Included templates are part of the
+        template that includes them, so they are not counted twice.
+    '''
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -1,15 +1,42 @@
+import json
+import os
 import random
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
 from datetime import timedelta
+from io import StringIO
 from django.urls import reverse
 from django.utils import timezone
 from django.forms import ValidationError
 from django.db.utils import IntegrityError
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, override_settings, RequestFactory
 from django.contrib.auth.models import User
 from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from .models import ConditionTag, Word, Language, Meaning, Game, Play, Hand, Guess, HandGuess, Vote, Choice, Condition
+from .models import ConditionTag, Word, Language, Meaning, Game, Play, Hand, Guess, HandGuess, Vote, Choice, Condition, GameArchive
 from . import utils
+from .routers import ReplicaRouter, GameShardRouter, use_replica, use_shard, reading_replica
+from .decorators import replica_reads
+from .lifecycle import hand_timings
+from .instrumentation import receiver_stats, receiver
+from .middleware import PerformanceMiddleware
+from .nplusone import NPlusOneError, detect_n_plus_one, fingerprint
+from .metrics import Registry, registry, hands_started, hands_finished
+from .capture import Replayer
+from .benchmarks import count_queries
+from .dictionary import CompiledDictionary
+from .cache import LRUCache, finished_hands, meanings, game_version, game_key, cached_for_game
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.template import engines
 
 def clean_data():
     for model in apps.get_models():
@@ -74,6 +101,9 @@ def create_random_guesses(game: Game):
 class BaseTestCase(TestCase):
     def setUp(self):
         clean_data()
+        finished_hands.clear()
+        meanings.clear()
+        cache.clear()
 
 
 class WordModelTest(BaseTestCase):
@@ -265,6 +295,117 @@ class MeaningModelTest(BaseTestCase):
         self.assertEqual(f'{word_text}: {content}', meaning.__str__(), 'Str function does not works!')
 
 
+class ImportDictionaryCommandTest(BaseTestCase):
+    def test_import_csv(self):
+        '''
+            Valid rows are inserted once, invalid and repeated ones are skipped.
+        '''
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('word,word_translation,text\n')
+            file.write('Cow,Vaca,Animal que da leche.\n')
+            file.write('Cat,Gato,Animal que hace miau.\n')
+            file.write('No,No,Too short word.\n')
+            file.write('Cow,Vaca,Otra definicion repetida.\n')
+
+        call_command('import_dictionary', file.name, language='ES', language_name='Spanish', batch_size=2, stdout=StringIO(), stderr=StringIO())
+        call_command('import_dictionary', file.name, language='ES', stdout=StringIO(), stderr=StringIO())
+        os.remove(file.name)
+
+        self.assertEqual(Word.objects.count(), 2)
+        self.assertEqual(Meaning.objects.get(word__word='Cow', language='ES').text, 'Animal que da leche.')
+
+
+class CompiledDictionaryTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lang = create_basic_language()
+        self.other = Language.objects.create(tag='ES', name='Spanish')
+
+        self.words = ['Cow', 'Diary', 'Python', 'Goose', 'Cheese']
+        for word in self.words:
+            create_word_meaning(word=word, language=self.lang, content=f'An explanation of what "{word}" is in English.', word_translation=word)
+
+        self.cow = Word.objects.get(word='Cow')
+        Meaning.objects.create(word=self.cow, language=self.other, word_translation='Vaca', text='Animal que da leche.')
+
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as file:
+            self.path = file.name
+        call_command('compile_dictionary', output=self.path, stdout=StringIO())
+        self.dictionary = CompiledDictionary(self.path)
+
+
+    def tearDown(self):
+        self.dictionary.close()
+        os.remove(self.path)
+
+
+    def test_meaning_lookup(self):
+        '''
+            Meanings are found by word id and language, missing ones are None.
+        '''
+        self.assertEqual(self.dictionary.meaning(self.cow.id, 'ES'), ('Cow', 'Vaca', 'Animal que da leche.'))
+        self.assertEqual(self.dictionary.meaning(self.cow.id, self.lang.tag).word_translation, 'Cow')
+        self.assertIsNone(self.dictionary.meaning(Word.objects.get(word='Goose').id, 'ES'))
+        self.assertIsNone(self.dictionary.meaning(self.cow.id, 'XX'))
+
+
+    def test_sample(self):
+        '''
+            Samples only have words of the language, without repeating them or the excluded ones.
+        '''
+        self.assertEqual(self.dictionary.sample('ES', 3), [self.cow.id])
+        self.assertEqual(self.dictionary.sample('ES', 3, exclude={self.cow.id}), [])
+
+        sample = self.dictionary.sample(self.lang.tag, 2, exclude={self.cow.id})
+        self.assertEqual(len(set(sample)), 2)
+        self.assertNotIn(self.cow.id, sample)
+
+
+    def test_choices_from_dictionary(self):
+        '''
+            With a compiled dictionary, choices are words with a meaning in the game's language.
+        '''
+        user = create_root_user()
+
+        with override_settings(COMPILED_DICTIONARY=self.path):
+            game = Game.objects.create(idiom=self.other, creator=user)
+            hand = Hand.objects.create(game=game, leader=user)
+
+        self.assertEqual(list(Choice.objects.filter(hand=hand).values_list('word_id', flat=True)), [self.cow.id])
+
+
+    def test_choices_of_a_stale_dictionary(self):
+        '''
+            Words deleted after compiling the dictionary are not chosen, others are drawn from the database instead.
+        '''
+        user = create_root_user()
+        Word.objects.get(word='Goose').delete()
+        create_word_meaning(word='Horse', language=self.lang, content='An explanation of what "Horse" is in English.', word_translation='Horse')
+
+        with override_settings(COMPILED_DICTIONARY=self.path):
+            game = Game.objects.create(idiom=self.lang, creator=user)
+            hand = Hand.objects.create(game=game, leader=user)
+
+        choices = set(Choice.objects.filter(hand=hand).values_list('word__word', flat=True))
+        self.assertEqual(choices, {'Cow', 'Diary', 'Python', 'Cheese', 'Horse'})
+
+
+    def test_meanings_from_dictionary(self):
+        '''
+            Meanings are read from the compiled dictionary, those it doesn't have from the database.
+        '''
+        added, _ = create_word_meaning(word='Horse', language=self.lang, content='An explanation of what "Horse" is in English.', word_translation='Horse')
+
+        with override_settings(COMPILED_DICTIONARY=self.path):
+            with self.assertNumQueries(0):
+                self.assertEqual(utils.get_meaning(self.cow.id, 'ES').word_translation, 'Vaca')
+
+            with self.assertNumQueries(1):
+                found = utils.get_meanings([self.cow.id, added.id], self.lang.tag)
+
+        self.assertEqual([found[self.cow.id].word, found[added.id].word], ['Cow', 'Horse'])
+
+
 class GameModelTest(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -412,6 +553,39 @@ class HandModelTest(BaseTestCase):
             self.fail("Valid Hand raised an error")
 
 
+    def test_original_guess_uses_game_language(self):
+        '''
+            The original guess is created once, when the word is chosen, with the meaning in the game's language.
+        '''
+        spanish = Language.objects.create(tag='ES', name='Spanish')
+        for word in Word.objects.all():
+            Meaning.objects.create(word=word, language=spanish, word_translation=f'{word.word} es', text=f'Que es "{word.word}" en castellano.')
+        game = Game.objects.create(idiom=spanish)
+        Play.objects.create(game=game, user=self.secondaryUser)
+
+        hand = Hand.objects.create(game=game)
+        hand.word = Choice.objects.filter(hand=hand)[0].word
+        hand.save()
+        hand.end()
+
+        self.assertEqual(list(Guess.objects.filter(hand=hand, is_original=True).values_list('content', flat=True)), [f'Que es "{hand.word.word}" en castellano.'])
+
+
+    def test_hand_lifecycle_queries(self):
+        '''
+            Creating a hand loads the game once and writes its choices in one query, every step is timed.
+        '''
+        hand_timings.reset()
+        game = Game.objects.get(pk=self.game.pk)
+
+        with CaptureQueriesContext(connection) as captured:
+            hand = Hand.objects.create(game=game)
+
+        self.assertLessEqual(count_queries(captured), 10)
+        self.assertEqual(Choice.objects.filter(hand=hand).count(), settings.CHOICES_PER_HAND)
+        self.assertEqual(set(hand_timings.stats()), {'load_game', 'unfinished_hand', 'leader', 'rotate_leader', 'choices'})
+
+
     def test_create_a_new_hand_with_no_leader(self):
         '''
             Create a new hand without 'leader'. The leader should be setted by default as the game creator (Beacuase is the only player)
@@ -470,6 +644,33 @@ class HandModelTest(BaseTestCase):
         self.assertEqual(second.leader.id, self.secondaryUser.id)
 
 
+    def test_hand_leader_default_setter_follows_seating_order(self):
+        '''
+            Every player leads once, from the last one who joined to the first, before leading again.
+        '''
+        Play.objects.create(game=self.game, user=self.secondaryUser)
+        players = list(reversed([self.user, self.secondaryUser] + create_n_players(n=2, game=self.game)))
+
+        for player in players + players[:1]:
+            hand = Hand.objects.create(game=self.game)
+            self.assertEqual(hand.leader.id, player.id)
+            hand.end()
+
+
+    def test_hand_leader_default_setter_skips_players_that_left(self):
+        '''
+            A player that leaves the game is removed from the rotation.
+        '''
+        Play.objects.create(game=self.game, user=self.secondaryUser)
+        third = create_user_and_play(username='third', password='333', game=self.game)
+
+        self.assertEqual(Hand.objects.create(game=self.game).leader.id, third.id)
+        Hand.objects.get(game=self.game).end()
+        Play.objects.get(game=self.game, user=self.secondaryUser).delete()
+
+        self.assertEqual(Hand.objects.create(game=self.game).leader.id, self.user.id)
+
+
     def test_set_default_choice(self):
         '''
             Test if the default creation of choice works.
@@ -782,6 +983,64 @@ class VoteModelTest(BaseTestCase):
             Vote.objects.create(to=HandGuess.objects.get(guess=self.guess), user=self.user)
 
 
+    def test_vote_rejection_uses_a_single_query(self):
+        '''
+            The vote admission check should fetch everything it needs at once.
+        '''
+        hg = HandGuess.objects.get(guess=self.guess)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(None, utils.vote_rejection(user=self.user, hand_guess_id=hg.id))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(utils.VoteRejection.IS_LEADER, utils.vote_rejection(user=self.secondaryUser, hand_guess_id=hg.id))
+
+
+class TrackChangesMixinTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_root_user()
+        self.lang = create_basic_language()
+        self.game = Game.objects.create(idiom=self.lang, creator=self.user)
+        self.word, self.meaning = create_word_meaning('House', language=self.lang, content='An explanation of what "HOUSE" is in English.', word_translation='HoUsE')
+        self.hand = Hand.objects.create(game=self.game, leader=self.user)
+
+
+    def test_previous_values_after_load(self):
+        '''
+            A loaded instance knows its previus values without querying again.
+        '''
+        hand = Hand.objects.get(id=self.hand.id)
+        hand.word = self.word
+
+        with self.assertNumQueries(0):
+            self.assertTrue(hand.has_changed('word'))
+            self.assertEqual(None, hand.previous('word'))
+            self.assertFalse(hand.has_changed('leader'))
+
+
+    def test_previous_values_after_save(self):
+        '''
+            After saving, the saved values become the previus ones.
+        '''
+        self.hand.word = self.word
+        self.hand.save()
+
+        self.assertFalse(self.hand.has_changed('word'))
+        self.assertEqual(self.word.id, self.hand.previous('word'))
+
+
+    def test_finished_game_can_not_be_reopened(self):
+        '''
+            Once a game has finished_at, it can not be changed.
+        '''
+        self.game.end()
+
+        with self.assertRaises(ValidationError):
+            self.game.finished_at = None
+            self.game.save()
+
+
 class ChoiceModelTest(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -826,6 +1085,37 @@ class ChoiceModelTest(BaseTestCase):
             Choice.objects.create(hand=secondHand, word=self.word)
             
 
+    def test_played_words_are_stored_in_game(self):
+        '''
+            Setting a hand word adds it to the game played words.
+        '''
+        Choice.objects.create(hand=self.hand, word=self.word)
+        self.hand.word = self.word
+        self.hand.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual({self.word.id}, self.game.played_word_ids())
+
+        self.assertEqual([self.word], self.game.words_played())
+
+
+    def test_stale_game_save_keeps_played_words_and_seating(self):
+        '''
+            Saving a game loaded before a word was played (e.g. in the admin) does not undo it.
+        '''
+        stale = Game.objects.get(pk=self.game.id)
+        Choice.objects.create(hand=self.hand, word=self.word)
+        self.hand.word = self.word
+        self.hand.save()
+        seating = Game.objects.values_list('seating', flat=True).get(pk=self.game.id)
+
+        stale.creator = None
+        stale.save()
+
+        game = Game.objects.get(pk=self.game.id)
+        self.assertEqual((game.creator, game.played_words, game.seating), (None, [self.word.id], seating))
+
+
     def test_create_a_new_choice_with_a_word_without_meaning(self):
         '''
             Create a new choice with a word with no meaning in the Game idiom.
@@ -994,6 +1284,56 @@ class UtilsFunctionsTest(BaseTestCase):
         self.assertEqual(len(utils.conditions_are_met(game_id=self.game.id)), 1)
 
 
+    def test_get_meanings(self):
+        '''
+            Meanings are loaded once, with one query for all the missing ones, and forgotten when they change.
+        '''
+        ids = [Word.objects.get(word=word).id for word in self.words[:3]]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(len(utils.get_meanings(ids, self.lang.tag)), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(utils.get_meaning(ids[0], self.lang.tag)), f'Cow: An explanation of what "Cow" is in English.')
+
+        meaning = Meaning.objects.get(word_id=ids[0], language=self.lang)
+        meaning.word_translation = 'Vaca'
+        meaning.save()
+
+        self.assertEqual(utils.get_meaning(ids[0], self.lang.tag).word_translation, 'Vaca')
+        self.assertEqual((meanings.hits, meanings.misses), (1, 4))
+
+
+    def test_lru_cache_ttl(self):
+        '''
+            Expired entries are missed.
+        '''
+        cache = LRUCache(ttl=0.01)
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+
+        time.sleep(0.02)
+        self.assertEqual(cache.get('key'), None)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+    def test_conditions_are_met_cache_is_invalidated(self):
+        '''
+            The cached result is used until a Play or Condition of the game changes.
+        '''
+        Condition.objects.create(game=self.game, tag=self.max, value=self.max.max)
+        self.assertEqual(len(utils.conditions_are_met(game_id=self.game.id)), 0)
+
+        with self.assertNumQueries(0):
+            utils.conditions_are_met(game_id=self.game.id)
+
+        version = game_version(self.game.id)
+        create_n_players(n=self.max.max, game=self.game)
+
+        self.assertGreater(game_version(self.game.id), version)
+        self.assertNotEqual(game_key(self.game.id, 'conditions'), f'game:{self.game.id}:v{version}:conditions')
+        self.assertEqual(len(utils.conditions_are_met(game_id=self.game.id)), 1)
+
+
     def test_is_leader(self):
         '''
             Is leader function should return True.
@@ -1078,6 +1418,29 @@ class UtilsFunctionsTest(BaseTestCase):
         self.assertEqual(utils.votes_remaining(game_id=self.game.id), 0)
 
 
+    def test_hand_progress_counters(self):
+        '''
+            The hand counters should follow guesses, checks and votes.
+        '''
+        Play.objects.create(game=self.game, user=self.secondaryUser)
+        hand = Hand.objects.create(game=self.game, leader=self.secondaryUser, word=self.word)
+        guess = Guess.objects.create(content='aaaaaaaaaaaaaaaaaaaaaaaaa', writer=self.user, hand=hand)
+
+        hand.refresh_from_db()
+        self.assertEqual((2, 1, 1, 0, 0), (hand.players_expected, hand.guesses_submitted, hand.pending_checks, hand.votes_cast, hand.correct_guessers))
+
+        hg = HandGuess.objects.get(hand=hand, guess=guess)
+        hg.is_correct = False
+        hg.save()
+        Vote.objects.create(user=self.user, to=hg)
+
+        hand.refresh_from_db()
+        self.assertEqual((0, 1, 0), (hand.pending_checks, hand.votes_cast, hand.votes_remaining))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(hand.progress()['votes_remaining'], 0)
+
+
     def test_already_vote(self):
         '''
             This function should return True if user already vote.
@@ -1181,6 +1544,97 @@ class UtilsFunctionsTest(BaseTestCase):
         self.assertFalse(utils.game_finished(game_id=self.game.id))
 
 
+class ReplicaRouterTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_root_user()
+        self.lang = create_basic_language()
+        self.game = Game.objects.create(idiom=self.lang, creator=self.user)
+        self.hand = Hand.objects.create(game=self.game)
+        self.databases_with_replica = {**settings.DATABASES, 'replica': settings.DATABASES['default']}
+
+
+    def test_reads_go_to_default_by_default(self):
+        with override_settings(DATABASES=self.databases_with_replica):
+            self.assertEqual(None, ReplicaRouter().db_for_read(Game))
+
+
+    def test_reads_go_to_replica_when_enabled(self):
+        with override_settings(DATABASES=self.databases_with_replica), use_replica():
+            self.assertEqual('replica', ReplicaRouter().db_for_read(Game))
+            self.assertEqual('default', ReplicaRouter().db_for_write(Game))
+
+
+    def test_reads_go_to_default_without_replica(self):
+        with override_settings(DATABASES={'default': settings.DATABASES['default']}), use_replica():
+            self.assertEqual(None, ReplicaRouter().db_for_read(Game))
+
+
+    def test_replica_reads_is_pinned_to_default_for_the_current_hand(self):
+        '''
+            A hand in progress must be read from default, a finished one from the replica.
+        '''
+        def view(request, hand_id):
+            return ReplicaRouter().db_for_read(Hand)
+
+        view = replica_reads(utils.hand_pinned)(view)
+        request = RequestFactory().get('/')
+        request.session = {}
+
+        with override_settings(DATABASES=self.databases_with_replica):
+            self.assertEqual(None, view(request, hand_id=self.hand.id))
+            self.hand.end()
+            self.assertEqual('replica', view(request, hand_id=self.hand.id))
+
+            # The user whose vote ended it reads it from default.
+            request.session[utils.PINNED_HAND] = self.hand.id
+            self.assertEqual(None, view(request, hand_id=self.hand.id))
+
+
+    def test_replica_reads_are_not_cached(self):
+        '''
+            Values built from the replica may lag behind, they are not cached for the game.
+        '''
+        with override_settings(DATABASES=self.databases_with_replica):
+            with use_replica():
+                self.assertEqual(1, cached_for_game(self.game.id, 'test', lambda: 1))
+            self.assertIsNone(cache.get(game_key(self.game.id, 'test')))
+
+            self.assertEqual(2, cached_for_game(self.game.id, 'test', lambda: 2))
+            self.assertEqual(2, cache.get(game_key(self.game.id, 'test')))
+
+
+@override_settings(GAME_SHARDS=['shard_0', 'shard_1'])
+class GameShardRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = GameShardRouter()
+
+
+    def test_game_models_are_routed_by_game_id(self):
+        self.assertEqual('shard_0', self.router.db_for_write(Game, instance=Game(id=4)))
+        self.assertEqual('shard_1', self.router.db_for_write(Game, instance=Game(id=5)))
+        self.assertEqual('shard_1', self.router.db_for_write(Play, instance=Play(game_id=5)))
+
+
+    def test_queries_inside_use_shard_go_to_the_game_shard(self):
+        with use_shard(game_id=3):
+            self.assertEqual('shard_1', self.router.db_for_read(Hand))
+            self.assertEqual('shard_1', self.router.db_for_write(Vote))
+
+
+    def test_reference_models_are_not_sharded(self):
+        with use_shard(game_id=3):
+            self.assertEqual(None, self.router.db_for_read(Word))
+            self.assertEqual(None, self.router.db_for_write(User))
+
+
+    def test_game_queries_outside_use_shard_raise(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.router.db_for_read(Hand)
+
+        self.assertEqual(None, self.router.db_for_read(Word))
+
+
 class GameViewTest(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -1473,6 +1927,50 @@ class HandViewTest(BaseTestCase):
         self.assertNotContains(response, self.words.__str__())
 
 
+    def test_hand_view_not_modified(self):
+        '''
+            While the game does not change, the page is not rendered again (304), after a change it is.
+        '''
+        login_root_user(self)
+        hand = Hand.objects.create(game=self.game, leader=self.user)
+
+        response = self.client.get(path=reverse('game:hand', args=[self.game.id]))
+        etag = response['ETag']
+
+        response = self.client.get(path=reverse('game:hand', args=[self.game.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        hand.word = self.word
+        hand.save()
+
+        response = self.client.get(path=reverse('game:hand', args=[self.game.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        login_secondary_user(self)
+        Play.objects.create(game=self.game, user=self.secondaryUser)
+        response = self.client.get(path=reverse('game:hand', args=[self.game.id]))
+        self.assertNotEqual(response['ETag'], etag)
+
+
+    def test_hand_view_etag_is_the_same_in_every_worker(self):
+        '''
+            The ETag does not depend on the cache of the worker (another one, or this one emptied), only on the game.
+        '''
+        login_root_user(self)
+        hand = Hand.objects.create(game=self.game, leader=self.user)
+        etag = self.client.get(path=reverse('game:hand', args=[self.game.id]))['ETag']
+
+        cache.clear()
+        response = self.client.get(path=reverse('game:hand', args=[self.game.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Changes that don't go through the signals count too.
+        Hand.update_progress(hand.id, guesses_submitted=1)
+        response = self.client.get(path=reverse('game:hand', args=[self.game.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
 class ChooseViewTest(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -1762,6 +2260,631 @@ class VoteViewTest(BaseTestCase):
         self.assertNotEqual(Game.objects.all()[0].finished_at, None)
 
 
+    def test_last_votes_at_the_same_time(self):
+        '''
+            When another request ends the hand between reading it and ending it, the vote still redirects
+            and the hand (and its game) are ended once.
+        '''
+        end = Hand.end
+        finished = registry.total(hands_finished.name)
+
+        def end_by_both(hand):
+            # The other last vote, with its own copy of the hand.
+            end(Hand.objects.get(pk=hand.pk))
+            end(hand)
+
+        login_secondary_user(self)
+        with mock.patch.object(Hand, 'end', end_by_both):
+            response = self.client.post(path=reverse('game:vote', args=[self.game.id]), data={'guess': self.secondary_guess.id})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(registry.total(hands_finished.name), finished + 1)
+        self.assertIsNotNone(Hand.objects.get(pk=self.hand.id).finished_at)
+
+        # Stale copies can't end the game twice either.
+        game, stale = Game.objects.get(pk=self.game.id), Game.objects.get(pk=self.game.id)
+        game.end()
+        with self.assertRaises(ValidationError):
+            stale.end()
+
+
+    def test_last_vote_reads_the_hand_from_default(self):
+        '''
+            The user whose vote ended the hand is sent to it, and reads it from default even with a replica.
+        '''
+        login_secondary_user(self)
+        self.client.post(path=reverse('game:vote', args=[self.game.id]), data={'guess': self.secondary_guess.id})
+        self.assertEqual(self.client.session[utils.PINNED_HAND], self.hand.id)
+
+        # The replica is default itself, the reads only record whether they would have gone to the replica.
+        replica_reads = []
+        def db_for_read(router, model, **hints):
+            replica_reads.append(reading_replica())
+
+        with override_settings(DATABASES={**settings.DATABASES, 'replica': settings.DATABASES['default']}):
+            with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read):
+                self.client.get(reverse('game:hand_detail', args=[self.hand.id]))
+                self.assertFalse(any(replica_reads))
+                self.assertIsNotNone(finished_hands.get(self.hand.id))
+
+                # Anyone else reads it from the replica, and that isn't cached.
+                finished_hands.clear()
+                login_root_user(self)
+                self.client.get(reverse('game:hand_detail', args=[self.hand.id]))
+                self.assertTrue(replica_reads[-1])
+                self.assertIsNone(finished_hands.get(self.hand.id))
+
+
+    def test_finished_hand_detail_is_cached(self):
+        '''
+            The details of a finished hand are built once, and built again after one of its rows changes.
+        '''
+        login_secondary_user(self)
+        self.client.post(path=reverse('game:vote', args=[self.game.id]), data={'guess': self.secondary_guess.id})
+
+        response = self.client.get(reverse('game:hand_detail', args=[self.hand.id]))
+        self.assertContains(response, f"Vote '{self.secondary_guess.content}' from {self.secondaryUser.username}")
+        self.client.get(reverse('game:hand_detail', args=[self.hand.id]))
+        self.assertEqual((finished_hands.hits, finished_hands.misses), (1, 1))
+
+        Vote.objects.all().delete()
+        self.assertIsNone(finished_hands.get(self.hand.id))
+
+        response = self.client.get(reverse('game:hand_detail', args=[self.hand.id]))
+        self.assertNotContains(response, f"Vote '{self.secondary_guess.content}'")
+
+
+    def test_lru_cache_limits(self):
+        '''
+            The least recently used entries are evicted when there are too many or they are too big.
+        '''
+        cache = LRUCache(max_entries=2, max_bytes=20)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        cache.get(1)
+        cache.set(3, 'c')
+
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.get(1), 'a')
+
+        cache.set(4, 'x' * 17)
+        self.assertEqual(list(cache.entries), [4])
+        cache.set(5, 'x' * 30)
+        self.assertEqual(cache.get(5), None)
+
+
+    def test_finished_game_is_archived(self):
+        '''
+            After the game ends archive_games moves its hands to a snapshot, and hand_detail still shows them.
+        '''
+        tag = create_condition_tag(tag='WIN_CONDITION', max=10, min=1)
+        Condition.objects.create(game=self.game, tag=tag, value=1)
+
+        login_secondary_user(self)
+        self.client.post(path=reverse('game:vote', args=[self.game.id]), data={'guess': self.secondary_guess.id})
+
+        # The request that ended the game did not archive it.
+        self.assertFalse(GameArchive.objects.exists())
+        out = StringIO()
+        call_command('archive_games', stdout=out)
+        call_command('archive_games', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['1 games archived', '0 games archived'])
+
+        self.assertFalse(Hand.objects.filter(game=self.game).exists())
+        self.assertFalse(Vote.objects.exists())
+        self.assertTrue(GameArchive.objects.filter(game=self.game).exists())
+
+        response = self.client.get(reverse('game:hand_detail', args=[self.hand.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f"Vote '{self.secondary_guess.content}' from {self.secondaryUser.username}")
+        self.assertContains(response, f'{self.secondaryUser.username}: 1pts')
+
+
+class ReceiverStatsTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_root_user()
+        self.lang = create_basic_language()
+        receiver_stats.reset()
+
+
+    def tearDown(self):
+        receiver_stats.enabled = False
+        receiver_stats.reset()
+
+
+    def test_receivers_are_timed_when_enabled(self):
+        '''
+            Only enabled stats are recorded, by signal, sender and receiver, with their queries.
+        '''
+        Game.objects.create(idiom=self.lang, creator=self.user)
+        self.assertEqual(receiver_stats.stats(), [])
+
+        receiver_stats.enabled = True
+        Game.objects.create(idiom=self.lang)
+        rows = {(row['signal'], row['sender'], row['receiver']): row for row in receiver_stats.stats()}
+
+        row = rows[('pre_save', 'Game', 'game.signals.user_already_playing_for_game_creation')]
+        self.assertEqual(row['calls'], 1)
+        self.assertIn(('post_save', 'Game', 'game.signals.game_cache_invalidation'), rows)
+
+
+    def test_receivers_disconnect_by_dispatch_uid(self):
+        '''
+            Instrumented receivers are connected with the public API, and disconnected with it too.
+        '''
+        from django.db.models.signals import pre_save
+        from .signals import user_already_playing_for_game_creation
+
+        key = ('pre_save', 'Game', 'game.signals.user_already_playing_for_game_creation')
+        receiver_stats.enabled = True
+
+        self.assertTrue(pre_save.disconnect(sender=Game, dispatch_uid=key[2]))
+        try:
+            Game.objects.create(idiom=self.lang)
+            self.assertNotIn(key, [(row['signal'], row['sender'], row['receiver']) for row in receiver_stats.stats()])
+        finally:
+            receiver(pre_save, sender=Game)(user_already_playing_for_game_creation)
+
+        Game.objects.create(idiom=self.lang)
+        self.assertIn(key, [(row['signal'], row['sender'], row['receiver']) for row in receiver_stats.stats()])
+
+
+    def test_receiver_stats_view(self):
+        '''
+            Staff can read and switch the stats, other users can't.
+        '''
+        login_root_user(self)
+        response = self.client.post(reverse('game:receiver_stats'), data={'enabled': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(receiver_stats.enabled)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(reverse('game:receiver_stats'), data={'enabled': '1'})
+        self.assertTrue(response.json()['enabled'])
+        self.assertTrue(receiver_stats.enabled)
+
+
+class PerformanceMiddlewareTest(BaseTestCase):
+    def test_server_timing(self):
+        '''
+            The response tells the time of the request, of its queries and of its templates, and how many queries repeat.
+        '''
+        create_basic_language()
+
+        def view(request):
+            list(Language.objects.filter(tag='EN'))
+            list(Language.objects.filter(tag='EN'))
+            list(Language.objects.filter(tag='ES'))
+            return HttpResponse(engines.all()[0].from_string('{{ value }}').render({'value': 'done'}))
+
+        with override_settings(SERVER_TIMING=True):
+            response = PerformanceMiddleware(view)(RequestFactory().get('/'))
+        timings = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+
+        self.assertEqual(response.content, b'done')
+        self.assertEqual(set(timings), {'total', 'db', 'tpl'})
+        self.assertIn('desc="3 queries (1 duplicated)"', timings['db'])
+
+
+    def test_server_timing_of_views(self):
+        '''
+            Every view goes through the middleware, and the pages it renders are timed. Only staff see the timings.
+        '''
+        user = create_root_user()
+        login_root_user(self)
+        response = self.client.get(reverse('game:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse('game:index'))
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+
+
+class NPlusOneDetectorTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lang = create_basic_language()
+        self.words = [Word.objects.create(word=f'word {i}') for i in range(4)]
+
+
+    def test_fingerprint(self):
+        '''
+            Queries that only differ in their values, or in how many of them there are, have the same shape.
+        '''
+        self.assertEqual(fingerprint('SELECT * FROM a WHERE id = 1'), fingerprint("SELECT * FROM a WHERE id = 22"))
+        self.assertEqual(fingerprint("SELECT * FROM a WHERE name = 'x'"), fingerprint('SELECT * FROM a WHERE name = %s'))
+        self.assertEqual(fingerprint('SELECT * FROM a WHERE id IN (%s, %s)'), fingerprint('SELECT * FROM a WHERE id IN (%s, %s, %s)'))
+        self.assertNotEqual(fingerprint('SELECT * FROM a WHERE id = 1'), fingerprint('SELECT * FROM b WHERE id = 1'))
+
+
+    @override_settings(N_PLUS_ONE={'enabled': True, 'threshold': 3, 'strict': False})
+    def test_detects_queries_in_a_loop(self):
+        '''
+            A shape run more than threshold times is a suspect, with the line that ran it. Below it nothing is.
+        '''
+        with detect_n_plus_one('loop') as detector:
+            [Word.objects.get(pk=word.pk) for word in self.words]
+
+        [suspect] = detector.suspects()
+        self.assertEqual(suspect['count'], 4)
+        self.assertTrue(suspect['origin'].startswith('game/tests.py:'))
+
+        with detect_n_plus_one('bulk') as detector:
+            list(Word.objects.filter(pk__in=[word.pk for word in self.words]))
+            [Word.objects.get(pk=word.pk) for word in self.words[:3]]
+
+        self.assertEqual(detector.suspects(), [])
+
+
+    @override_settings(N_PLUS_ONE={'enabled': True, 'threshold': 3, 'strict': True})
+    def test_strict_mode(self):
+        '''
+            In strict mode the suspects raise.
+        '''
+        with self.assertRaises(NPlusOneError):
+            with detect_n_plus_one('loop'):
+                [Word.objects.get(pk=word.pk) for word in self.words]
+
+        with detect_n_plus_one('bulk'):
+            list(Word.objects.filter(pk__in=[word.pk for word in self.words]))
+
+
+class TracingTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_root_user()
+        self.lang = create_basic_language()
+        self.game = Game.objects.create(idiom=self.lang, creator=self.user)
+        self.spans_file = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False).name
+
+
+    def tearDown(self):
+        os.remove(self.spans_file)
+
+
+    def spans(self) -> list[dict]:
+        with open(self.spans_file) as file:
+            return [json.loads(line) for line in file]
+
+
+    def test_request_trace(self):
+        '''
+            The request is the root span, the event it sends and the receivers it runs belong to its trace.
+        '''
+        login_root_user(self)
+
+        with override_settings(TRACING={'file': self.spans_file}):
+            self.client.get(reverse('game:waiting', args=[self.game.id]))
+
+        spans = {span['name']: span for span in self.spans()}
+        root = spans['GET game:waiting']
+        self.assertIsNone(root['parent_id'])
+        self.assertEqual(root['attributes'], {'game_id': self.game.id, 'status': 200})
+        self.assertEqual(spans['ws_event']['parent_id'], root['span_id'])
+        self.assertEqual({span['trace_id'] for span in spans.values() if not span['name'].startswith('connection_created')}, {root['trace_id']})
+
+
+    def test_trace_report(self):
+        '''
+            An action is done when its last client was notified, traces without a timed delivery are left out.
+        '''
+        with open(self.spans_file, 'w') as file:
+            for span in [
+                {'trace_id': 't', 'span_id': 'a', 'parent_id': None, 'name': 'POST game:vote', 'attributes': {}},
+                {'trace_id': 't', 'span_id': 'b', 'parent_id': 'a', 'name': 'consumer.new_vote', 'attributes': {'game_id': 7, 'notified_ms': 3.0}},
+                {'trace_id': 't', 'span_id': 'c', 'parent_id': 'a', 'name': 'consumer.new_vote', 'attributes': {'game_id': 7, 'notified_ms': 5.0}},
+                # A delivery that failed before it was timed.
+                {'trace_id': 'u', 'span_id': 'd', 'parent_id': None, 'name': 'consumer.new_vote', 'attributes': {'game_id': 7}},
+            ]:
+                file.write(json.dumps(span) + '\n')
+
+        out = StringIO()
+        call_command('trace_report', file=self.spans_file, stdout=out)
+        self.assertIn('POST game:vote                                  1      2.0      5.00      5.00      5.00', out.getvalue())
+
+
+class MetricsTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_root_user()
+        self.lang = create_basic_language()
+        self.game = Game.objects.create(idiom=self.lang, creator=self.user)
+
+        for word in ['Cow', 'Diary', 'Python', 'Goose', 'Cheese']:
+            create_word_meaning(word=word, language=self.lang, content=f'An explanation of what "{word}" is in English.', word_translation=word)
+
+
+    def test_metrics_view(self):
+        '''
+            Hands, views and games are counted, in the Prometheus text format.
+        '''
+        started = registry.total(hands_started.name)
+        finished = registry.total(hands_finished.name)
+
+        Hand.objects.create(game=self.game, leader=self.user).end()
+        self.assertEqual(registry.total(hands_started.name), started + 1)
+        self.assertEqual(registry.total(hands_finished.name), finished + 1)
+
+        finished_hands.set(1, {'votes': []})
+        finished_hands.get(1)
+
+        login_root_user(self)
+        self.client.get(reverse('game:waiting', args=[self.game.id]))
+        self.assertEqual(self.client.get(reverse('game:metrics')).status_code, 403)
+
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('game:metrics'), headers={'Authorization': 'Bearer secret'})
+        lines = response.content.decode().splitlines()
+
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('# TYPE bleff_view_latency_seconds histogram', lines)
+        self.assertIn('bleff_active_games 1', lines)
+        self.assertIn('bleff_players_per_game_bucket{le="1"} 1', lines)
+        self.assertTrue(any(line.startswith('bleff_view_latency_seconds_count{view="game:waiting"}') for line in lines))
+        # The process-local caches, read when collecting.
+        self.assertIn('bleff_cache_hits_total{cache="finished_hands"} 1', lines)
+        self.assertIn('bleff_cache_entries{cache="finished_hands"} 1', lines)
+        self.assertTrue(any(line.startswith('bleff_cache_misses_total{cache="meanings"}') for line in lines))
+
+
+    def test_workers_are_added_up(self):
+        '''
+            The samples of the other workers are read from their files, the gauges of the ones that are gone are not.
+        '''
+        with tempfile.TemporaryDirectory() as dir:
+            worker = Registry(dir=dir)
+            worker.families = registry.families
+            worker.add('bleff_hands_started_total', (), 2)
+            worker.add('bleff_websockets_open', (('game', '1'),), 3)
+            worker.flush()
+
+            # Another worker, and one that is gone.
+            os.rename(os.path.join(dir, f'metrics-{os.getpid()}.json'), os.path.join(dir, f'metrics-{os.getppid()}.json'))
+            worker.flush()
+            os.rename(os.path.join(dir, f'metrics-{os.getpid()}.json'), os.path.join(dir, 'metrics-999999999.json'))
+
+            reader = Registry(dir=dir)
+            reader.families = registry.families
+            samples = reader.collect()
+            worker.close()
+
+        self.assertEqual(samples[('bleff_hands_started_total', ())], 4)
+        self.assertEqual(samples[('bleff_websockets_open', (('game', '1'),))], 3)
+        # The other workers are only read when collecting.
+        self.assertEqual(reader.total('bleff_hands_started_total'), 4)
+
+
+    def test_flush_errors_are_not_raised(self):
+        '''
+            Metrics that can't be written are logged, the request that collected them goes on.
+        '''
+        with tempfile.TemporaryDirectory() as dir:
+            worker = Registry(dir=os.path.join(dir, 'metrics'))
+            self.assertTrue(os.path.isdir(worker.dir))
+
+        with self.assertLogs('game.metrics', level='ERROR'):
+            worker.add('bleff_hands_started_total', (), 1)
+            worker.stopped.set()
+            worker.flush()
+
+
+    def test_samples_are_flushed_by_a_thread(self):
+        '''
+            Adding a sample doesn't write the file, a thread of the worker does it every flush_interval.
+        '''
+        with tempfile.TemporaryDirectory() as dir:
+            worker = Registry(dir=dir, flush_interval=0.01)
+            worker.families = registry.families
+            worker.add('bleff_hands_started_total', (), 2)
+
+            path = os.path.join(dir, f'metrics-{os.getpid()}.json')
+            deadline = time.monotonic() + 5
+            while not os.path.exists(path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            worker.close()
+            self.assertFalse(worker.flusher.is_alive())
+            with open(path) as file:
+                self.assertEqual(json.load(file), [['bleff_hands_started_total', [], 2]])
+
+
+    def test_unknown_metrics_of_other_workers_are_skipped(self):
+        '''
+            A worker running other code may write metrics this one never registered, they are left out.
+        '''
+        with tempfile.TemporaryDirectory() as dir:
+            with open(os.path.join(dir, f'metrics-{os.getppid()}.json'), 'w') as file:
+                json.dump([['bleff_renamed_total', [], 1], ['bleff_hands_started_total', [], 2]], file)
+
+            reader = Registry(dir=dir)
+            reader.families = registry.families
+            samples = reader.other_samples()
+
+        self.assertEqual(samples, {('bleff_hands_started_total', ()): 2})
+
+
+class CaptureReplayTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_root_user()
+        self.secondaryUser = create_secondary_user()
+        self.lang = create_basic_language()
+        create_condition_tag(tag='MAX_PLAYERS', max=8, min=2)
+        create_condition_tag(tag='MIN_PLAYERS', max=8, min=2)
+        self.capture_file = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False).name
+
+        for word in ['Cow', 'Diary', 'Python', 'Goose', 'Cheese', 'Milk']:
+            create_word_meaning(word=word, language=self.lang, content=f'An explanation of what "{word}" is in English.', word_translation=word)
+
+
+    def tearDown(self):
+        os.remove(self.capture_file)
+
+
+    def play_hand(self):
+        login_root_user(self)
+        self.client.post(reverse('game:create'), data={'language': self.lang.tag, 'MAX_PLAYERS': 2, 'MIN_PLAYERS': 2})
+        game = Game.objects.get()
+
+        login_secondary_user(self)
+        self.client.post(reverse('game:enter_game'), data={'game': game.id})
+
+        login_root_user(self)
+        self.client.post(reverse('game:start_game', args=[game.id]))
+        hand = utils.get_game_hand(game_id=game.id)
+        players = {self.user: login_root_user, self.secondaryUser: login_secondary_user}
+
+        players[hand.leader](self)
+        self.client.post(reverse('game:choose', args=[game.id]), data={'choice': Choice.objects.filter(hand=hand).last().word.word})
+
+        for login in players.values():
+            login(self)
+            self.client.post(reverse('game:make_guess', args=[game.id]), data={'guess': 'A guess.'})
+
+        players[hand.leader](self)
+        self.client.post(reverse('game:check_guesses', args=[game.id]), data={str(guess.id): 'False' for guess in Guess.objects.filter(hand=hand)})
+
+        voter = next(user for user in players if user != hand.leader)
+        players[voter](self)
+        self.client.post(reverse('game:vote', args=[game.id]), data={'guess': Guess.objects.get(hand=hand, is_original=True).id})
+        self.client.get(reverse('game:hand_detail', args=[hand.id]))
+
+
+    def test_replay(self):
+        '''
+            A captured hand is played again in a database without its game, with other ids.
+        '''
+        random.seed(0)
+        with override_settings(CAPTURE={'file': self.capture_file}):
+            self.play_hand()
+
+        with open(self.capture_file) as file:
+            actions = [json.loads(line) for line in file]
+
+        self.assertEqual([action['v'] for action in actions][:3], ['game:create', 'game:enter_game', 'game:start_game'])
+        self.assertEqual(actions[0]['c'], Game.objects.get().id)
+        Game.objects.all().delete()
+
+        random.seed(0)
+        replayer = Replayer(speed=0)
+        replayer.replay(actions)
+
+        self.assertEqual(sum(result['skipped'] + result['diverged'] for result in replayer.results.values()), 0)
+        self.assertEqual(len(replayer.results['POST game:make_guess']['latencies']), 2)
+        self.assertEqual(Hand.objects.filter(finished_at__isnull=False).count(), 1)
+        self.assertNotEqual(Game.objects.get().id, actions[0]['c'])
+
+
+class SimulateLoadCommandTest(SimpleTestCase):
+    def test_bots_play_every_hand(self):
+        '''
+            The bots play their games to the end through the views and the WebSockets. The command runs in its own
+            process because it sets up its own throwaway database.
+        '''
+        command = [sys.executable, 'manage.py', 'simulate_load', '--games', '1', '--players', '3', '--hands', '1', '--think', '0.01', '--timeout', '60', '--seed', '0']
+        result = subprocess.run(command, cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=120)
+
+        lines = result.stdout.splitlines()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertTrue(lines[0].startswith('1 games, 1 hands finished'), lines[0])
+        self.assertTrue(all(int(line.split()[3]) == 0 for line in lines[2:]), result.stdout)
+
+
+    def test_bots_play_several_games_of_several_hands(self):
+        '''
+            Every game stops once its own hands are finished, not when a hand of it just started.
+        '''
+        command = [sys.executable, 'manage.py', 'simulate_load', '--games', '2', '--players', '3', '--hands', '3', '--think', '0.01', '--timeout', '90', '--seed', '1']
+        result = subprocess.run(command, cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=150)
+
+        lines = result.stdout.splitlines()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertTrue(lines[0].startswith('2 games, 6 hands finished'), lines[0])
+        self.assertNotIn('stopped by the timeout', lines[0])
+        self.assertTrue(all(int(line.split()[3]) == 0 for line in lines[2:]), result.stdout)
+
+
+class GameStateViewTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_root_user()
+        self.secondaryUser = create_secondary_user()
+        self.lang = create_basic_language()
+        self.game = Game.objects.create(idiom=self.lang, creator=self.user)
+        Play.objects.create(game=self.game, user=self.secondaryUser)
+
+        self.words = ['Cow', 'Diary', 'Python', 'Goose', 'Cheese']
+        for word in self.words:
+            create_word_meaning(word=word, language=self.lang, content=f'An explanation of what "{word}" is in English.', word_translation=word)
+
+        self.hand = Hand.objects.create(game=self.game)
+
+
+    def test_state_of_leader_choosing(self):
+        '''
+            The leader gets the words to choose, the other player doesn't.
+        '''
+        self.client.force_login(self.hand.leader)
+        state = self.client.get(reverse('game:state', args=[self.game.id])).json()
+
+        self.assertEqual(state['phase'], 'choosing')
+        self.assertEqual(state['hand']['leader']['id'], self.hand.leader.id)
+        self.assertEqual(len(state['you']['choices']), settings.CHOICES_PER_HAND)
+        self.assertEqual([s['points'] for s in state['scores']], [0, 0])
+
+        other = self.user if self.hand.leader == self.secondaryUser else self.secondaryUser
+        self.client.force_login(other)
+        state = self.client.get(reverse('game:state', args=[self.game.id])).json()
+        self.assertEqual(state['you']['choices'], [])
+
+
+    def test_state_voting(self):
+        '''
+            Once every guess was checked the guesses are shown, without their writers.
+        '''
+        self.hand.word = Choice.objects.filter(hand=self.hand)[0].word
+        self.hand.save()
+        create_random_guesses(game=self.game)
+
+        login_root_user(self)
+        state = self.client.get(reverse('game:state', args=[self.game.id])).json()
+
+        self.assertEqual(state['phase'], 'voting')
+        self.assertTrue(state['you']['guessed'])
+        self.assertEqual(len(state['hand']['guesses']), 3)
+        self.assertNotIn('writer', state['hand']['guesses'][0])
+
+
+    def test_state_waiting_after_a_hand(self):
+        '''
+            Between hands the phase and the last hand come from the same read of the latest hand.
+        '''
+        self.hand.word = Choice.objects.filter(hand=self.hand)[0].word
+        self.hand.save()
+        self.hand.end()
+
+        login_root_user(self)
+        state = self.client.get(reverse('game:state', args=[self.game.id])).json()
+
+        self.assertEqual(state['phase'], 'waiting')
+        self.assertEqual(state['last_hand_id'], self.hand.id)
+        self.assertEqual(state['last_finished_hand_id'], self.hand.id)
+        self.assertIsNone(state['hand'])
+
+
+    def test_state_not_playing(self):
+        '''
+            Only players get the state of a game.
+        '''
+        outsider = User.objects.create_user(username='outsider', password='outsider_password')
+        self.client.force_login(outsider)
+        response = self.client.get(reverse('game:state', args=[self.game.id]))
+        self.assertEqual(response.status_code, 403)
+
+
 class PointsFunctionTest(BaseTestCase):
     def setUp(self):
         super().setUp()
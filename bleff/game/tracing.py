@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+
+# The span running in this context, the parent of the next one.
+current_span = ContextVar('current_span', default=None)
+
+# Key of the trace context in the channel layer events, see inject and extracted.
+TRACE_KEY = 'trace'
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: str | None = None, trace_start: float | None = None, **attributes) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time()
+        # When the action that started the trace happened, so any span knows how long after it ends.
+        self.trace_start = trace_start or self.start
+        self.attributes = attributes
+        self.duration = None
+
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id, 'name': self.name,
+            'start': self.start, 'trace_start': self.trace_start, 'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+        }
+
+
+class FileExporter:
+    '''
+        Appends every finished span as one JSON line to a local file, processes can share it. The file is
+        opened once, and flushed after every line so the other processes' lines are not interleaved with it.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict()) + '\n'
+
+        with self.lock:
+            if not self.file:
+                self.file = open(self.path, 'a')
+
+            self.file.write(line)
+            self.file.flush()
+
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+_exporter = None
+
+
+def exporter() -> FileExporter | None:
+    '''
+        The exporter of settings.TRACING['file'], None when tracing is off.
+    '''
+    global _exporter
+    path = getattr(settings, 'TRACING', {}).get('file')
+
+    if not path:
+        return None
+    elif not _exporter or _exporter.path != path:
+        if _exporter:
+            _exporter.close()
+        _exporter = FileExporter(path)
+
+    return _exporter
+
+
+@contextmanager
+def span(name: str, parent: dict | None = None, **attributes):
+    '''
+        Records the block as a span, the child of the current span or, for a trace that comes from another
+        process, of parent (see extracted). A span without either starts a new trace. Does nothing when
+        tracing is off.
+    '''
+    export = exporter()
+
+    if not export:
+        yield None
+        return
+
+    outer = current_span.get()
+    if parent:
+        new = Span(name, parent['trace_id'], parent['span_id'], parent['trace_start'], **attributes)
+    elif outer:
+        new = Span(name, outer.trace_id, outer.span_id, outer.trace_start, **attributes)
+    else:
+        new = Span(name, os.urandom(16).hex(), **attributes)
+
+    token = current_span.set(new)
+    start = time.perf_counter()
+
+    try:
+        yield new
+    except Exception as exc:
+        new.attributes['error'] = type(exc).__name__
+        raise
+    finally:
+        new.duration = time.perf_counter() - start
+        current_span.reset(token)
+        export.export(new)
+
+
+def traced(name: str):
+    '''
+        Runs the decorated function inside span(name).
+    '''
+    def decorator(func):
+        @wraps(func)
+        def _wrapped(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return _wrapped
+    return decorator
+
+
+def inject(event: dict) -> dict:
+    '''
+        Adds the current span to a channel layer event, so its handlers continue the trace.
+    '''
+    active = current_span.get()
+
+    if active:
+        event[TRACE_KEY] = {'trace_id': active.trace_id, 'span_id': active.span_id, 'trace_start': active.trace_start, 'sent_at': time.time()}
+
+    return event
+
+
+def extracted(event: dict) -> dict | None:
+    return event.get(TRACE_KEY)
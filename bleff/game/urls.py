@@ -17,4 +17,7 @@ urlpatterns = [
     path("<int:game_id>/hand/guesses/", views.guesses_view, name="guesses"),
     path("<int:game_id>/hand/guess/vote", views.vote, name="vote"),
     path("hand/<int:hand_id>/", views.hand_detail, name="hand_detail"),
+    path("<int:game_id>/state", views.game_state_view, name="state"),
+    path("debug/receivers", views.receiver_stats_view, name="receiver_stats"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
\ No newline at end of file
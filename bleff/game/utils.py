@@ -1,7 +1,13 @@
+import hashlib
+from enum import Enum
+from collections import namedtuple
 from django.contrib.auth.models import User
-from django.db.models import Model
+from django.db.models import Model, Count, Max, Exists, OuterRef, Subquery
 
-from .models import Hand, Play, Choice, Game, Condition, HandGuess, Vote
+from .models import Hand, Play, Choice, Game, Condition, HandGuess, Vote, ArchivedHand, Meaning
+from .cache import cached_for_game, meanings
+from .dictionary import get_dictionary
+from .tracing import traced
 
 class FilteredObject:
     def __init__(self, dictionary: dict) -> None:
@@ -29,6 +35,23 @@ class ConditionsResult:
         return result
 
 
+class MeaningEntry(namedtuple('MeaningEntry', ['word', 'word_translation', 'text'])):
+    '''
+        Cached copy of a Meaning (with its word), printed like one.
+    '''
+
+    def __str__(self) -> str:
+        return f'{self.word_translation}: {self.text}'
+
+
+class VoteRejection(Enum):
+    NOT_PLAYING = "You can't vote in a game you are not playing"
+    IS_LEADER = "You can't vote if you are the leader"
+    HAND_FINISHED = "You can't vote in a finished hand"
+    ALREADY_VOTED = "You can't vote again in the same hand"
+    GUESSED_RIGHT = "You can't vote if you guessed right"
+
+
 def plays_game(user: User, game_id: int) -> bool:
     return Play.objects.filter(game=game_id, user=user).exists()
 
@@ -44,6 +67,40 @@ def get_game_hand(game_id: int):
         return Hand.objects.get(game=game_id, finished_at=None) if exists else None 
 
 
+def get_meanings(word_ids: list[int], language: str) -> dict[int, MeaningEntry]:
+    '''
+        Meanings of word_ids in language, by word id. They are read from the compiled dictionary if there is one,
+        and those it doesn't have (or all of them without it) from the cache. The rest are loaded with one query.
+    '''
+    found = {}
+    missing = []
+    dictionary = get_dictionary()
+
+    for word_id in word_ids:
+        entry = dictionary.meaning(word_id, language) if dictionary else None
+        if entry is not None:
+            found[word_id] = MeaningEntry(*entry)
+            continue
+
+        entry = meanings.get((word_id, language))
+        if entry is None:
+            missing.append(word_id)
+        else:
+            found[word_id] = MeaningEntry(*entry)
+
+    if missing:
+        rows = Meaning.objects.filter(word_id__in=missing, language=language).values_list('word_id', 'word__word', 'word_translation', 'text')
+        for word_id, *fields in rows:
+            found[word_id] = MeaningEntry(*fields)
+            meanings.set((word_id, language), found[word_id])
+
+    return found
+
+
+def get_meaning(word_id: int, language: str) -> MeaningEntry | None:
+    return get_meanings([word_id], language).get(word_id)
+
+
 def get_hand_choice_words(hand: Hand) -> list:
     return [c.word for c in Choice.objects.filter(hand=hand)]
 
@@ -55,6 +112,10 @@ def remove_fields(object: Model, fields: list[str], filters=dict[str, any]) -> l
 
 
 def conditions_are_met(game_id: int) -> list[ConditionsResult]:
+    return cached_for_game(game_id, 'conditions', lambda: _conditions_are_met(game_id=game_id))
+
+
+def _conditions_are_met(game_id: int) -> list[ConditionsResult]:
     game = Game.objects.get(id=game_id)
     conditions = Condition.objects.filter(game=game)
     cant_players = Play.objects.filter(game=game).count()
@@ -81,16 +142,13 @@ def is_leader(user: User, game_id: int) -> bool:
 
 
 def there_are_guesses_to_check(game_id: int) -> bool:
-    return HandGuess.objects.filter(hand=get_game_hand(game_id=game_id), is_correct=None).exists()
+    hand = get_game_hand(game_id=game_id)
+    return hand.pending_checks > 0 if hand else False
 
 
 def votes_remaining(game_id: int) -> int:
     hand = get_game_hand(game_id=game_id)
-    hand_guesses = [hg.id for hg in HandGuess.objects.filter(hand=hand, is_correct=False)]
-    users_count = Play.objects.filter(game__id=game_id).count() - 1
-    users_who_guessed_right = HandGuess.objects.filter(hand=hand, is_correct=True).count()
-    
-    return users_count - users_who_guessed_right - Vote.objects.filter(to_id__in=hand_guesses).count()
+    return hand.votes_remaining if hand else Play.objects.filter(game__id=game_id).count() - 1
 
 
 def already_vote(user: User, game_id: int) -> bool:
@@ -104,47 +162,88 @@ def last_hand(game_id: int) -> Hand | None:
 
 def guesses_ready(game_id: int) -> bool:
     hand = get_game_hand(game_id=game_id)
-    return not HandGuess.objects.filter(hand=hand, is_correct=None).exists()
+    return not hand.pending_checks if hand else True
 
 
 def points_in_game(user: User, game_id: int) -> int:
-    played = Play.objects.filter(user=user, game__id=game_id)
+    return players_points(game_id=game_id).get(user.id, 0)
+
+
+def players_points(game_id: int) -> dict[int, int]:
+    '''
+        Points of every player of the game by user id, with the same queries whatever the number of players.
+    '''
+    players = list(Play.objects.filter(game__id=game_id).values_list('user_id', flat=True))
+
+    if not players:
+        return {}
 
-    # If played does not exists, then the player didn't play this game.
-    if not played:
-        return 0
-    
-    game = played[0].game
-    
     # TODO: Every pointing area could be customized.
-    
-    # Points for votes to your guesses. +1 for each
-    your_guesses = HandGuess.objects.filter(guess__writer=user, is_correct=False, hand__game=game).exclude(hand__leader=user)
-    votes_to_your_guesses = Vote.objects.filter(to__in=your_guesses).count()
+    points = {player: 0 for player in players}
+
+    # Points for votes to your guesses (unless you lead the hand). +1 for each
+    for writer, leader in Vote.objects.filter(to__guess__writer__in=players, to__is_correct=False, to__hand__game__id=game_id).values_list('to__guess__writer', 'to__hand__leader'):
+        if writer != leader:
+            points[writer] += 1
 
     # Points for guessing right. CUSTOM
-    right_guesses = HandGuess.objects.filter(guess__writer=user, is_correct=True, hand__game=game).count()
+    right_guesses = dict(HandGuess.objects.filter(guess__writer__in=players, is_correct=True, hand__game__id=game_id).values('guess__writer').annotate(n=Count('id')).values_list('guess__writer', 'n'))
 
     # Points for being the leader and nobody voted the right one. CUSTOM
-    definitions = HandGuess.objects.filter(guess__is_original=True, hand__leader=user)
-    clean_leader_play = definitions.exclude(id__in=[hg['to'] for hg in Vote.objects.filter(to__in=definitions).values('to')]).count()
+    clean_leader_play = dict(
+        HandGuess.objects.filter(guess__is_original=True, hand__leader__in=players)
+        .exclude(Exists(Vote.objects.filter(to=OuterRef('pk'))))
+        .values('hand__leader').annotate(n=Count('id')).values_list('hand__leader', 'n')
+    )
 
     # Points for your votes to the right definition. +1
-    right_votes = Vote.objects.filter(user=user, to__guess__is_original=True).count()
+    for voter, n in Vote.objects.filter(user__in=players, to__guess__is_original=True).values('user').annotate(n=Count('id')).values_list('user', 'n'):
+        points[voter] += n
 
     # Sets the custom points values.
-    for condition in Condition.objects.filter(game=game):
+    right_guess_points, clean_leader_points = 1, 1
+    for condition in Condition.objects.filter(game__id=game_id).select_related('tag'):
         tag = str(condition.tag)
         if tag == 'POINTS_FOR_GUESSING_RIGHT':
-            right_guesses *= condition.value
+            right_guess_points *= condition.value
         elif tag == 'POINTS_FOR_CLEAN_LEADER':
-            clean_leader_play *= condition.value
+            clean_leader_points *= condition.value
+
+    for player in players:
+        points[player] += right_guesses.get(player, 0) * right_guess_points + clean_leader_play.get(player, 0) * clean_leader_points
 
-    return votes_to_your_guesses + right_guesses + clean_leader_play + right_votes
+    return points
     
 
 def get_game_users(game_id: int) -> list[User]:
-    return [p.user for p in Play.objects.filter(game__id=game_id)]
+    return [p.user for p in Play.objects.filter(game__id=game_id).select_related('user')]
+
+
+def game_points(game_id: int) -> list[dict]:
+    '''
+        Scoreboard of the game: every player with their points.
+    '''
+    def build():
+        points = players_points(game_id=game_id)
+        return [{'user': user, 'value': points.get(user.id, 0)} for user in get_game_users(game_id=game_id)]
+
+    return cached_for_game(game_id, 'points', build)
+
+
+def game_id_of(instance: Model) -> int | None:
+    '''
+        Id of the game a Play, Hand, Condition, Guess, HandGuess or Vote belongs to, None if it is gone.
+    '''
+    if isinstance(instance, Game):
+        return instance.id
+    elif hasattr(instance, 'game_id'):
+        return instance.game_id
+    elif isinstance(instance, Vote):
+        return HandGuess.objects.filter(pk=instance.to_id).values_list('hand__game_id', flat=True).first()
+    elif type(instance).hand.is_cached(instance):
+        return instance.hand.game_id
+
+    return Hand.objects.filter(pk=instance.hand_id).values_list('game_id', flat=True).first()
 
 
 def guessed_right(user: User, hand: Hand):
@@ -152,6 +251,7 @@ def guessed_right(user: User, hand: Hand):
     return hg.is_correct
 
 
+@traced('game_finished')
 def game_finished(game_id: int) -> bool:
     """
         Return True if a player has WIN_CONDITION.value points.
@@ -160,8 +260,71 @@ def game_finished(game_id: int) -> bool:
     win_condition = Condition.objects.filter(tag__tag="WIN_CONDITION", game=game)
 
     if win_condition.exists():
-        for user in get_game_users(game_id=game_id):
-            if points_in_game(user=user, game_id=game_id) >= win_condition[0].value:
+        for points in game_points(game_id=game_id):
+            if points['value'] >= win_condition[0].value:
                 return True
             
     return False
+
+
+def vote_rejection(user: User, hand_guess_id: int) -> VoteRejection | None:
+    """
+        Checks if user can vote hand_guess_id, fetching everything in a single query. Returns None if the vote is admitted.
+    """
+    state = HandGuess.objects.filter(id=hand_guess_id).annotate(
+        plays=Exists(Play.objects.filter(game=OuterRef('hand__game'), user=user)),
+        current_leader=Subquery(Hand.objects.filter(game=OuterRef('hand__game'), finished_at=None).values('leader')[:1]),
+        voted=Exists(Vote.objects.filter(to__hand=OuterRef('hand'), user=user)),
+        guessed_right=Exists(HandGuess.objects.filter(hand=OuterRef('hand'), is_correct=True, guess__writer=user)),
+    ).values('plays', 'current_leader', 'voted', 'guessed_right', 'hand__finished_at').get()
+
+    if not state['plays']:
+        return VoteRejection.NOT_PLAYING
+    elif state['current_leader'] == user.id:
+        return VoteRejection.IS_LEADER
+    elif state['hand__finished_at']:
+        return VoteRejection.HAND_FINISHED
+    elif state['voted']:
+        return VoteRejection.ALREADY_VOTED
+    elif state['guessed_right']:
+        return VoteRejection.GUESSED_RIGHT
+
+    return None
+
+
+# Session key of the hand the user just finished with their vote.
+PINNED_HAND = 'pinned_hand'
+
+
+def hand_in_progress(request, hand_id: int, **kwargs) -> bool:
+    return Hand.objects.filter(id=hand_id, finished_at=None).exists()
+
+
+def hand_pinned(request, hand_id: int, **kwargs) -> bool:
+    '''
+        True for a hand in progress, and for the hand whose last vote was this user's (see views.vote), so they
+        read their own writes on the page they are sent to.
+    '''
+    return getattr(request, 'session', {}).get(PINNED_HAND) == int(hand_id) or hand_in_progress(request, hand_id)
+
+
+def never_pinned(request, **kwargs) -> bool:
+    return False
+
+
+def game_state_etag(request, game_id: int, **kwargs) -> str:
+    """
+        ETag of a game page: it changes with the game's players, its last hand (word, progress and end), its end
+        and the user looking at it. It is read from the database, so every worker gives the same one.
+    """
+    game = Game.objects.filter(pk=game_id).annotate(players=Count('play'), last_play=Max('play__id')).values_list('finished_at', 'players', 'last_play').first()
+    hand = Hand.objects.filter(game_id=game_id).order_by('-created_at', '-id').values_list('id', 'word_id', 'finished_at', *Hand.PROGRESS_FIELDS).first()
+
+    return f'{game_id}-{hashlib.md5(repr((game, hand)).encode()).hexdigest()}-{request.user.id}'
+
+
+def hand_state_etag(request, hand_id: int, **kwargs) -> str | None:
+    game_id = Hand.objects.filter(id=hand_id).values_list('game_id', flat=True).first() \
+        or ArchivedHand.objects.filter(id=hand_id).values_list('archive_id', flat=True).first()
+
+    return game_state_etag(request, game_id=game_id) if game_id else None
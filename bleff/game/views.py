@@ -1,16 +1,23 @@
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404, JsonResponse
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.utils.crypto import constant_time_compare
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
+from django.utils import timezone
 from django.views import generic
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.decorators.http import require_POST, require_GET
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_POST, require_GET, require_http_methods, condition
 from django.db.models import Model
+from django.forms import ValidationError
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
-from .models import Game, HandGuess, Language, Meaning, Play, Hand, Vote, Word, Guess, ConditionTag, Condition
+from .models import Game, HandGuess, Language, Choice, Play, Hand, Vote, Word, Guess, ConditionTag, Condition
 from .utils import (
     plays_game,
     get_game_hand,
@@ -18,15 +25,27 @@ from .utils import (
     remove_fields,
     conditions_are_met,
     is_leader,
-    votes_remaining,
     already_vote,
     last_hand,
-    points_in_game,
-    get_game_users,
+    game_points,
     guessed_right,
-    game_finished
+    game_finished,
+    hand_pinned,
+    PINNED_HAND,
+    never_pinned,
+    game_state_etag,
+    hand_state_etag,
+    get_meanings,
+    get_meaning
 )
-from .decorators import play_required, leader_required, conditions_met
+from .decorators import play_required, leader_required, conditions_met, replica_reads
+from .archive import archived_hand_context, snapshot_hand
+from .cache import finished_hands
+from .routers import reading_replica
+from .state import game_state
+from .instrumentation import receiver_stats
+from .tracing import span, inject
+from .metrics import registry, database_samples, render as render_metrics, broadcast_fanout, vote_to_hand_end
 
 def handle_redirection(request):
     # If does not exists a Play with this user and a game unfinished.
@@ -57,7 +76,7 @@ def handle_redirection(request):
   
     # If the guess was already made and you are the leader, then you must check.
     is_leader_var = is_leader(request.user, game_id=game.id)
-    if is_leader_var and HandGuess.objects.filter(is_correct=None).exists():
+    if is_leader_var and hand.pending_checks:
         return HttpResponseRedirect(reverse("game:check_guesses", args=(game.id,)))
 
 
@@ -92,12 +111,18 @@ def update_or_none(model: Model):
 
 def ws_event(data, game_id):
     channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'game_{game_id}',
-        data
-    )
+
+    broadcast_fanout.observe(registry.total('bleff_websockets_open', game=game_id))
+
+    # The consumers continue the trace of the action that sent the event.
+    with span('ws_event', game_id=game_id, type=data['type']):
+        async_to_sync(channel_layer.group_send)(
+            f'game_{game_id}',
+            inject(data)
+        )
 
 
+@method_decorator(replica_reads(never_pinned), name='dispatch')
 class IndexView(generic.ListView):
     model = Game
     template_name = "game/index.html"
@@ -121,9 +146,9 @@ class IndexView(generic.ListView):
 @require_GET
 @play_required(handle_redirection)
 def waiting(request, game_id):
-    game = get_object_or_404(Game, id=game_id)
-    conditions = Condition.objects.filter(game=game)
-    users = [p.user.username for p in Play.objects.filter(game=game_id)]
+    game = get_object_or_404(Game.objects.select_related('creator'), id=game_id)
+    conditions = Condition.objects.filter(game=game).select_related('tag')
+    users = list(Play.objects.filter(game=game_id).values_list('user__username', flat=True))
 
     ws_event({
         'player_username': request.user.username,
@@ -209,15 +234,18 @@ def start_game(request, game_id):
 @login_required
 @play_required(handle_redirection)
 @conditions_met(handle_redirection)
+@condition(etag_func=game_state_etag)
 def hand_view(request, game_id):
     hand = get_game_hand(game_id)
     words = []
     word = ''
     
     if request.user.id == hand.leader.id and not hand.word:
-        words = [Meaning.objects.get(word=w, language=hand.game.idiom) for w in get_hand_choice_words(hand=hand)]
+        word_ids = list(Choice.objects.filter(hand=hand).values_list('word_id', flat=True))
+        meanings = get_meanings(word_ids, hand.game.idiom_id)
+        words = [meanings[word_id] for word_id in word_ids if word_id in meanings]
     elif hand.word:
-        word = Meaning.objects.get(word=hand.word, language=hand.game.idiom).word_translation
+        word = get_meaning(hand.word_id, hand.game.idiom_id).word_translation
 
     return render(request, 'game/hand.html', {"hand": hand, "words_to_choose": words, "game_id": game_id, "game": hand.game, "word": word })
 
@@ -263,13 +291,15 @@ def make_guess(request, game_id):
     
 
     if (guess_created):
+        hand.refresh_from_db(fields=Hand.PROGRESS_FIELDS)
         ws_event({
             'type': 'new_guess',
             'new_guess': {
                 'content': guess,
                 'id': guess_created.id,
                 'word': hand.word.word
-            }
+            },
+            'progress': hand.progress()
         }, game_id)
 
     return HttpResponseRedirect(reverse("game:guesses", args=(game_id,))) if guess_created else handle_redirection(request=request)
@@ -279,6 +309,7 @@ def make_guess(request, game_id):
 @require_GET
 @play_required(handle_redirection)
 @conditions_met(handle_redirection)
+@condition(etag_func=game_state_etag)
 def guesses_view(request, game_id):
     if is_leader(user=request.user, game_id=game_id):
         return HttpResponseRedirect(reverse("game:check_guesses", args=(game_id,)))
@@ -288,11 +319,13 @@ def guesses_view(request, game_id):
     template_name = "game/guesses.html"
     hand = get_game_hand(game_id=game_id)
 
-    guesses_ready = not HandGuess.objects.filter(hand=hand, is_correct=None).exists()
+    guesses_ready = not hand.pending_checks
 
-    hand_guesses = remove_fields(object=HandGuess, fields=['writer'], filters={'hand': get_game_hand(game_id=game_id), 'is_correct': False})
+    hand_guesses = remove_fields(object=HandGuess, fields=['writer'], filters={'hand': hand, 'is_correct': False})
 
-    guesses = [Guess.objects.get(pk=hg.guess_id) for hg in hand_guesses] if guesses_ready else []
+    # One query for every guess, in the order of their hand guesses.
+    guesses_by_id = Guess.objects.in_bulk([hg.guess_id for hg in hand_guesses]) if guesses_ready else {}
+    guesses = [guesses_by_id[hg.guess_id] for hg in hand_guesses if hg.guess_id in guesses_by_id]
 
     context = {
         'hand': hand,
@@ -309,17 +342,17 @@ def guesses_view(request, game_id):
 @conditions_met(handle_redirection)
 def check_guesses(request, game_id):
     hand = get_game_hand(game_id=game_id)
-    guesses = [hg.guess for hg in HandGuess.objects.filter(hand=hand, is_correct=None)]
+    hand_guesses = list(HandGuess.objects.filter(hand=hand, is_correct=None).select_related('guess'))
+    guesses = [hg.guess for hg in hand_guesses]
 
     if len(guesses) == 0:
         return handle_redirection(request=request)
 
     if request.method == 'POST':
-        for g in guesses:
-            set_as = request.POST[str(g.id)]
+        for hand_guess in hand_guesses:
+            set_as = request.POST[str(hand_guess.guess_id)]
 
             if set_as:
-                hand_guess = get_object_or_404(HandGuess, hand=hand, guess=g)
                 hand_guess.is_correct = True if set_as == 'True' else False
                 update_or_none(hand_guess)
 
@@ -346,15 +379,22 @@ def vote(request, game_id):
     if not vote:
         return handle_redirection(request=request)
 
-    hand = get_game_hand(game_id=game_id)
+    # The hand of the vote, another vote may have just ended it.
+    hand = Hand.objects.get(pk=guess_hand.hand_id)
 
     # TODO: and hand... wierd.
-    if votes_remaining(game_id=game_id) == 0:
-        hand.end()
-
-        if game_finished(game_id=game_id):
-            game = Game.objects.get(id=game_id)
-            game.end()
+    if not hand.finished_at and hand.votes_remaining == 0:
+        try:
+            hand.end()
+        except ValidationError:
+            # Another vote ended the hand at the same time, and that request ends the game.
+            hand.finished_at = timezone.now()
+        else:
+            if game_finished(game_id=game_id):
+                game = Game.objects.get(id=game_id)
+                game.end()
+
+            vote_to_hand_end.observe((timezone.now() - vote.created_at).total_seconds())
             
     # WebSocket connection...
     if not hand.finished_at:
@@ -363,37 +403,98 @@ def vote(request, game_id):
             'new_vote': {
                 'content': guess.content,
                 'votant': request.user.username
-            }
+            },
+            'progress': hand.progress()
         }, game_id)
     else:
         ws_event({'type': 'hand_finished'}, game_id)
+        # The hand page is read from the primary for this user, the replica may not have the end yet.
+        request.session[PINNED_HAND] = hand.id
 
     return HttpResponseRedirect(reverse("game:hand_detail", args=(hand.id,)))
 
 
 @require_GET
+@condition(etag_func=hand_state_etag)
+@replica_reads(hand_pinned)
 def hand_detail(request, hand_id):
-    hand = get_object_or_404(Hand, id=hand_id)
+    hand = Hand.objects.filter(id=hand_id).first()
+
+    # Hands of finished games are read from their game snapshot.
+    if not hand:
+        context = archived_hand_context(hand_id=hand_id)
+        if not context:
+            raise Http404('Hand does not exist')
+
+        return render(request=request, template_name='game/hand_detail.html', context=context)
 
     hand_guesses = [hg.id for hg in HandGuess.objects.filter(hand=hand)]
-    votes = Vote.objects.filter(to_id__in=hand_guesses)
+    votes = Vote.objects.filter(to_id__in=hand_guesses).select_related('to__guess', 'user')
 
     if not hand.finished_at:
         return render(request=request, template_name='game/hand_detail.html', context={'hand': hand, 'votes': votes, 'game_id': hand.game.id})
 
-    guesses = [hg.guess for hg in HandGuess.objects.filter(hand=hand, guess__writer__isnull=False)]
-
-    for guess in guesses:
-        guess.votes = Vote.objects.filter(to__guess=guess).count()
+    # A finished hand does not change anymore, so its guesses and votes are built once per process.
+    snapshot = finished_hands.get(hand.id)
+    if snapshot is None:
+        meaning = get_meaning(hand.word_id, hand.game.idiom_id) if hand.word_id else None
+        snapshot = snapshot_hand(hand=hand, word_translation=meaning.word_translation if meaning else None)
+        # Only what was read from the primary is kept, the replica may still be missing the last votes.
+        if not reading_replica():
+            finished_hands.set(hand.id, snapshot)
 
     game = hand.game
     context = {
         'hand': hand,
-        'votes': Vote.objects.filter(to_id__in=hand_guesses),
-        'guesses': guesses,
-        'game_id': hand.game.id,
-        'word': Meaning.objects.get(word=hand.word, language=hand.game.idiom).word_translation,
-        'points': [{'user': user, 'value': points_in_game(user=user, game_id=game.id)} for user in get_game_users(game_id=game.id)]
+        'votes': snapshot['votes'],
+        'guesses': snapshot['guesses'],
+        'game_id': game.id,
+        'word': snapshot['word_translation'],
+        'points': game_points(game_id=game.id)
     }
 
     return render(request=request, template_name='game/hand_detail.html', context=context)
+
+
+def forbidden_json(request):
+    return JsonResponse({'error': "You don't play this game"}, status=403)
+
+
+@login_required
+@require_GET
+@play_required(forbidden_json)
+@condition(etag_func=game_state_etag)
+def game_state_view(request, game_id):
+    return JsonResponse(game_state(game_id=game_id, user=request.user), json_dumps_params={'separators': (',', ':')})
+
+
+@staff_member_required
+@require_http_methods(['GET', 'POST'])
+def receiver_stats_view(request):
+    '''
+        Time and queries of the receivers in game.signals. POST 'enabled', 'log' (1 or 0) and 'reset' to change them.
+    '''
+    if request.method == 'POST':
+        if 'enabled' in request.POST:
+            receiver_stats.enabled = request.POST['enabled'] == '1'
+        if 'log' in request.POST:
+            receiver_stats.log = request.POST['log'] == '1'
+        if request.POST.get('reset') == '1':
+            receiver_stats.reset()
+
+    return JsonResponse({'enabled': receiver_stats.enabled, 'log': receiver_stats.log, 'receivers': receiver_stats.stats()})
+
+
+@require_GET
+def metrics_view(request):
+    '''
+        Metrics of every worker (see game.metrics) in the Prometheus text format. Only for staff, or with
+        settings.METRICS_TOKEN as a bearer token.
+    '''
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.headers.get('Authorization', '')
+
+    if not request.user.is_staff and not (token and constant_time_compare(authorization, f'Bearer {token}')):
+        raise PermissionDenied
+
+    return HttpResponse(render_metrics({**registry.collect(), **database_samples()}), content_type='text/plain; version=0.0.4; charset=utf-8')